@@ -0,0 +1,104 @@
+"""
+Benchmarks for the execution core of TestMan.
+
+Each benchmark prepares a synthetic workload and reports its throughput, in
+operations (steps, expansions, runs, ...) per second, and the peak memory that
+was allocated while performing it.
+
+  % python -m benchmarks                       # run all benchmarks
+  % python -m benchmarks steps expand          # run some benchmarks
+  % python -m benchmarks --scale 0.1           # use smaller workloads
+  % python -m benchmarks --save baseline.json  # save the results...
+  % python -m benchmarks --compare baseline.json  # ...and compare with them
+
+When comparing, benchmarks that lost more than `--tolerance` (default 20%) of
+their throughput are reported as regressions, and the exit code is 1.
+"""
+
+import gc
+import json
+import time
+import tracemalloc
+
+benchmarks = {} # name -> (function, unit)
+
+def benchmark(unit):
+  """
+  Registers a benchmark: a function that, given a scale, prepares a workload
+  and returns a callable that performs it and the number of operations it
+  performs.
+  """
+  def register(func):
+    benchmarks[func.__name__] = (func, unit)
+    return func
+  return register
+
+class Result():
+  def __init__(self, name, unit, operations, seconds, peak):
+    self.name       = name
+    self.unit       = unit
+    self.operations = operations
+    self.seconds    = seconds
+    self.peak       = peak
+
+  @property
+  def throughput(self):
+    return self.operations / self.seconds if self.seconds else float("inf")
+
+  def as_dict(self):
+    return {
+      "unit"       : self.unit,
+      "operations" : self.operations,
+      "seconds"    : self.seconds,
+      "throughput" : self.throughput,
+      "peak"       : self.peak
+    }
+
+  def __str__(self):
+    return f"{self.name:<12} {self.throughput:>12,.0f} {self.unit}/s " \
+           f"{self.seconds*1000:>10.1f} ms {self.peak/1024/1024:>8.1f} MB peak"
+
+def measure(name, scale=1.0, repeat=3):
+  """
+  Performs a benchmark `repeat` times, keeping the best time, and once more
+  while tracing memory allocations.
+  """
+  func, unit = benchmarks[name]
+  best = None
+  for _ in range(repeat):
+    perform, operations = func(scale)
+    gc.collect()
+    start   = time.perf_counter()
+    perform()
+    seconds = time.perf_counter() - start
+    best    = seconds if best is None else min(best, seconds)
+  perform, operations = func(scale)
+  gc.collect()
+  tracemalloc.start()
+  try:
+    perform()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return Result(name, unit, operations, best, peak)
+
+def regressions(results, baseline, tolerance=0.2):
+  """
+  Returns the names of the benchmarks whose throughput dropped more than the
+  tolerance, compared to a baseline.
+  """
+  return [
+    result.name for result in results
+    if result.name in baseline and
+       result.throughput < baseline[result.name]["throughput"] * (1 - tolerance)
+  ]
+
+def save(results, filename):
+  with open(filename, "w") as fp:
+    json.dump({ result.name : result.as_dict() for result in results }, fp, indent=2)
+
+def load(filename):
+  with open(filename) as fp:
+    return json.load(fp)
+
+from benchmarks import workloads
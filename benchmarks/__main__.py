@@ -0,0 +1,45 @@
+import sys
+import argparse
+import logging
+
+import benchmarks
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    prog="python -m benchmarks", description="Benchmarks for TestMan"
+  )
+  parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+  parser.add_argument("--scale",     type=float, default=1.0)
+  parser.add_argument("--repeat",    type=int,   default=3)
+  parser.add_argument("--save",      help="save the results to a JSON file")
+  parser.add_argument("--compare",   help="compare with results in a JSON file")
+  parser.add_argument("--tolerance", type=float, default=0.2)
+  args = parser.parse_args(argv)
+
+  # per step logging would dominate the measurements
+  logging.disable(logging.INFO)
+
+  names = args.names or list(benchmarks.benchmarks)
+  unknown = [ name for name in names if not name in benchmarks.benchmarks ]
+  if unknown:
+    parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+  results = []
+  for name in names:
+    result = benchmarks.measure(name, scale=args.scale, repeat=args.repeat)
+    print(result, flush=True)
+    results.append(result)
+
+  if args.save:
+    benchmarks.save(results, args.save)
+  if args.compare:
+    regressed = benchmarks.regressions(
+      results, benchmarks.load(args.compare), tolerance=args.tolerance
+    )
+    for name in regressed:
+      print(f"regression: {name}")
+    return 1 if regressed else 0
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
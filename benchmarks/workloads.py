@@ -0,0 +1,132 @@
+"""
+Synthetic workloads for the execution core.
+"""
+
+import os
+import tempfile
+
+import testman
+from testman.util import expand
+from testman.state import YamlState, JsonState
+
+from benchmarks import benchmark
+
+def sized(scale, size):
+  return max(int(size * scale), 1)
+
+def mock_step(name, **kwargs):
+  return dict({ "name" : name, "perform" : "testman.testers.mock.test" }, **kwargs)
+
+@benchmark("steps")
+def steps(scale):
+  """
+  Many steps, using the mock tester.
+  """
+  size = sized(scale, 2000)
+  test = testman.Test.from_dict({
+    "name"  : "many steps",
+    "steps" : [ mock_step(f"step {index}", **{ "with" : { "value" : index } })
+                for index in range(size) ]
+  })
+  return test.execute, size
+
+def nested(depth, width):
+  if depth == 0:
+    return "{VALUE}-{OTHER}"
+  return {
+    f"key{index}" : [ nested(depth - 1, width), "literal", depth ]
+    for index in range(width)
+  }
+
+@benchmark("expansions")
+def expand_args(scale):
+  """
+  Deeply nested arguments with placeholders, expanded in a fresh scope.
+  """
+  size = sized(scale, 500)
+  args = nested(4, 3)
+  vars = { "VALUE" : "value", "OTHER" : "other" }
+  def perform():
+    for _ in range(size):
+      expand(args, dict(vars))
+  return perform, size
+
+def large_output(size=1000, value=None):
+  return { "value" : value, "items" : [ { "index" : index } for index in range(size) ] }
+
+@benchmark("steps")
+def outputs(scale):
+  """
+  Steps with large outputs, referred to by the next step using STEP.
+  """
+  size = sized(scale, 200)
+  test = testman.Test.from_dict({
+    "name"  : "large outputs",
+    "steps" : [
+      { "name" : f"step {index}", "perform" : "benchmarks.workloads.large_output",
+        "with" : { "value" : f"STEP[{index-1}].value" } if index else { "value" : 1 },
+        "assert" : "len(result['items']) == 1000" }
+      for index in range(size)
+    ]
+  })
+  return test.execute, size
+
+@benchmark("assertions")
+def assertions(scale):
+  """
+  Steps with many assertions.
+  """
+  size = sized(scale, 200)
+  test = testman.Test.from_dict({
+    "name"  : "assertions",
+    "steps" : [
+      mock_step(f"step {index}", **{
+        "with"   : { "value" : index, "name" : "step" },
+        "assert" : [ f"result.value == {index}", "result.name == 'step'",
+                     "result.value >= 0", "all(c.isalpha() for c in result.name)",
+                     "'value' in result" ] * 4
+      })
+      for index in range(size)
+    ]
+  })
+  return test.execute, size * 20
+
+def executed_suite(tests, steps, runs):
+  suite = testman.Suite("large", [
+    testman.Test.from_dict({
+      "name"  : f"test {index}",
+      "steps" : [ mock_step(f"step {step}", **{
+                    "with" : { "value" : step }, "always" : True
+                  }) for step in range(steps) ]
+    }) for index in range(tests)
+  ])
+  for _ in range(runs):
+    suite.execute()
+  return suite
+
+def state(scale, State, extension):
+  tests  = sized(scale, 50)
+  suite  = executed_suite(tests, 10, 5)
+  folder = tempfile.TemporaryDirectory()
+  def perform():
+    filename = os.path.join(folder.name, f"state.{extension}")
+    stored   = State(filename)
+    stored.add(suite)
+    stored.changed(suite.name)
+    State(filename)[suite.name] # load it again
+    folder # keep it around until the workload is performed
+  return perform, tests * 10 * 5
+
+@benchmark("runs")
+def json_state(scale):
+  """
+  Persisting and loading a large suite using JsonState.
+  """
+  return state(scale, JsonState, "json")
+
+@benchmark("runs")
+def yaml_state(scale):
+  """
+  Persisting and loading a large suite using YamlState.
+  """
+  return state(scale, YamlState, "yaml")
@@ -52,7 +52,7 @@ if __name__ == "__main__":
   setuptools.setup(
     name=NAME,
     version=VERSION,
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=["benchmarks", "benchmarks.*"]),
     author=AUTHOR,
     description=DESCRIPTION,
     long_description=LONG_DESCRIPTION,
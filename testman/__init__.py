@@ -3,16 +3,50 @@ __version__ = "0.0.7"
 import logging
 logger = logging.getLogger(__name__)
 
-import os
 import traceback
 import uuid
 import datetime
+import functools
+import contextlib
+import contextvars
+import copy
+import time
+import re
+import inspect
+import threading
 
-from testman.util import get_function, expand, prune, mapped
+# asyncio and concurrent.futures are imported when they are needed,
+# to keep startup fast
+
+from testman.util import get_function, expand, prune, mapped, utcnow
+from testman.util import register
+from testman.expression import Namespace, scoped, compiled, evaluate
+from testman.expression import compile_source, references, subscripts, bound
+from testman.pool import pooled, propagate
 
 # TODO create Command class
 from testman.util import parse_command, format_command, postprocess
 
+_memory = contextvars.ContextVar("testman.memory", default=None)
+
+def memory():
+  """
+  Returns the memory of the step that is being executed: a dict that testers
+  can use to keep information from one run to the next, e.g. to only process
+  what is new since the previous run. Outside of a step, it is a new dict.
+  """
+  current = _memory.get()
+  return current if current is not None else {}
+
+_profile = contextvars.ContextVar("testman.profile", default=None)
+
+def profile(directory="profiles"):
+  """
+  Profiles the execution of all steps using cProfile, dumping the statistics
+  of every run in the given directory. Use None to stop profiling.
+  """
+  _profile.set(directory)
+
 states = [ "unknown", "success", "ignored", "pending", "failed" ]
 states_map = { state : index for index, state in enumerate(states) }
 def reduce_states(l):
@@ -23,6 +57,37 @@ def reduce_states(l):
       state = si
   return states[state]
 
+class Counts():
+  """
+  keeps the number of parts (steps or tests) in each state, updated as their
+  states change, so that the aggregated state is available without revisiting
+  all parts.
+  """
+  def __init__(self, statuses=None):
+    self.counts = { state : 0 for state in states }
+    self._lock  = threading.Lock()
+    for status in statuses or []:
+      self.counts[status] += 1
+
+  def update(self, before, after):
+    """
+    Moves a part from one state to another (or adds it, if before is None).
+    Returns the aggregated state before and after the update.
+    """
+    with self._lock:
+      previous = self.status
+      if before:
+        self.counts[before] -= 1
+      self.counts[after] += 1
+      return previous, self.status
+
+  @property
+  def status(self):
+    for state in reversed(states):
+      if self.counts[state]:
+        return state
+    return "unknown"
+
 class Suite():
   """
   is a collection of Tests, that can be managed as a whole.
@@ -31,6 +96,8 @@ class Suite():
     self.name       = name
     self.tests      = [] if tests is None else tests
     self._on_change = []
+    for test in self.tests: test.suite = self
+    self._counts    = Counts(test.status for test in self.tests)
 
   @classmethod
   def from_dict(cls, d):
@@ -64,18 +131,60 @@ class Suite():
 
   def add(self, test):
     self.tests.append(test)
+    test.suite = self
+    self._counts.update(None, test.status)
     self._notify("add", test)
     return self
 
-  def execute(self):
+  def execute(self, workers=None, processes=False):
     """
-    Executes all tests.
+    Executes all tests. With more than one worker, tests are executed
+    concurrently, using a pool of threads or, optionally, processes.
+    Connections opened by testers are reused by all tests, see `testman.pool`.
     """
-    for test in self.tests:
-      test.execute()
+    with pooled():
+      if workers and workers > 1 and len(self.tests) > 1:
+        if processes:
+          self._execute_in_processes(workers)
+        else:
+          from concurrent.futures import ThreadPoolExecutor
+          with ThreadPoolExecutor(max_workers=workers) as pool:
+            tasks = [ propagate(test.execute) for test in self.tests ]
+            for _ in pool.map(lambda task: task(), tasks):
+              pass
+      else:
+        for test in self.tests:
+          test.execute()
+    self._notify("execute", self)
+    return self
+
+  async def execute_async(self, concurrency=None):
+    """
+    Executes all tests concurrently on the running event loop, with at most
+    `concurrency` tests in flight at the same time.
+    """
+    import asyncio
+    limit = asyncio.Semaphore(concurrency) if concurrency else None
+    async def execute(test):
+      if limit:
+        async with limit:
+          await test.execute_async()
+      else:
+        await test.execute_async()
+    with pooled():
+      await asyncio.gather(*[ execute(test) for test in self.tests ])
     self._notify("execute", self)
     return self
 
+  def _execute_in_processes(self, workers):
+    # tests are shipped to and from the worker processes as dicts, their runs
+    # are merged back into the tests of this suite
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      executed = pool.map(execute_test, [ test.as_dict() for test in self.tests ])
+      for test, result in zip(self.tests, executed):
+        test.merge(Test.from_dict(result))
+
   def reset(self):
     """
     Resets all test, removing all previous runs' information.
@@ -85,6 +194,32 @@ class Suite():
     self._notify("reset", self)
     return self
 
+  @property
+  def stats(self):
+    """
+    Latency statistics per phase of all tests.
+    """
+    stats = Stats()
+    for test in self.tests:
+      stats.merge(test.stats)
+    return stats
+
+  def capture(self, capture):
+    """
+    Apply a capture policy to the outputs of all tests.
+    """
+    for test in self.tests:
+      test.capture(capture)
+    return self
+
+  def trim(self, retention):
+    """
+    Apply a retention policy to the runs of all tests.
+    """
+    for test in self.tests:
+      test.trim(retention)
+    return self
+
   @property
   def overview(self):
     """
@@ -95,9 +230,14 @@ class Suite():
   @property
   def status(self):
     """
-    Aggregate the status of the tests into one status for the suite.
+    Aggregate the status of the tests into one status for the suite. It is
+    maintained as the status of tests changes.
     """
-    return reduce_states([ reduce_states(test) for test in self.overview ])
+    return self._counts.status
+
+  def _update(self, before, after):
+    # the status of one of the tests changed
+    self._counts.update(before, after)
 
   @property
   def results(self):
@@ -113,23 +253,49 @@ class Suite():
         "gmail": {"done": 2, "pending": 0, "ignored": 0, "summary": "all done"}
       }
     """
-    def summary(status):
-      s = { s : status.count(s) for s in states }
-      in_progress = s["pending"] + s["unknown"]
-      s["summary"] = f"{in_progress} in progress" if in_progress else "all done"
-      return s
-      
-    return { test.uid : summary(test.overview) for test in self.tests }
+    return { test.uid : summarize(test.counts) for test in self.tests }
+
+def step_status(last, ignore=False, noretry=False):
+  """
+  Determines the status of a step, given the status of its last run, if any.
+  """
+  if last == "success":
+    return "success"
+  if last == "failed" and ignore:
+    return "ignored"
+  if last == "failed" and noretry:
+    return "failed"
+  if last == "failed":
+    return "pending"
+  return "unknown"
+
+def summarize(counts):
+  """
+  Turns a dict with the number of steps in each state into a summary.
+  """
+  s = { state : counts.get(state, 0) for state in states }
+  in_progress = s["pending"] + s["unknown"]
+  s["summary"] = f"{in_progress} in progress" if in_progress else "all done"
+  return s
+
+def execute_test(d):
+  """
+  Executes a marshalled test and returns it marshalled, e.g. in a worker
+  process.
+  """
+  with pooled():
+    return Test.from_dict(d).execute().as_dict()
 
 class Constant():
   def __init__(self, expression, value=None):
-    self.expression = expression
-    self.value      = value
+    self.expression  = expression
+    self.value       = value
+    self._expression = compiled(expression)
     if not self.value:
       self.reset()
   
   def reset(self):
-    self.value = expand(self.expression)
+    self.value = evaluate(self._expression)
 
   @classmethod
   def from_dict(cls, d):
@@ -167,16 +333,33 @@ class Test():
   >>> d2 = t2.as_dict()
   >>> d1 == d2
   True
+
+  When `parallel` is set, steps are scheduled according to their dependencies:
+  a step depends on the previous steps it refers to using `STEP[n]`. Steps
+  that don't depend on each other are executed concurrently, and a failing
+  step (without `continue`) only prevents the steps that depend on it.
   """
   def __init__(self, description, steps, uid=None,
-                     variables=None, constants=None, work_dir=None):
-    self.uid         = uid if uuid else str(uuid.uuid4())
+                     variables=None, constants=None, work_dir=None,
+                     parallel=False):
+    self.uid         = uid if uid else str(uuid.uuid4())
     self.description = description
     self._variables  = variables
-    self.constants   = constants
+    self._compiled   = compiled(variables or {})
+    self.constants   = constants or {}
     self.work_dir    = work_dir
+    self.parallel    = parallel
     self.steps       = steps
+    self.suite       = None
     for step in steps: step.test = self # adopt tests (FIXME)
+    self._statuses   = { id(step) : step.status for step in steps }
+    self._counts     = Counts(self._statuses.values())
+    self.dependencies = self._analyse()
+    self.dependents   = [
+      { later for later, dependencies in enumerate(self.dependencies)
+              if index in dependencies }
+      for index in range(len(self.steps))
+    ]
     logger.debug(f"loaded '{self.description}' with {len(self.steps)} steps")
 
   @classmethod
@@ -193,7 +376,8 @@ class Test():
     ]
     return Test(
       description, steps, uid=uid,
-      variables=variables, constants=constants, work_dir=work_dir
+      variables=variables, constants=constants, work_dir=work_dir,
+      parallel=d.get("parallel", False)
     )
 
   def as_dict(self):
@@ -204,6 +388,7 @@ class Test():
       "variables": self._variables,
       "constants": { name: constant.as_dict() for name, constant in self.constants.items() },
       "work_dir" : self.work_dir,
+      "parallel" : self.parallel,
       "steps"    : [ step.as_dict() for step in self.steps ]
     })
 
@@ -211,12 +396,163 @@ class Test():
     """
     Run the entire script.
     """
-    with WorkIn(self.work_dir):
-      for step in self.steps:
-        step.execute(self.vars)
-        if step.abort:
+    context = Context(self)
+    logger.info(f"▶ {self.description}")
+    with pooled():
+      try:
+        if self.parallel:
+          return self._execute_graph(context)
+        for index, step in enumerate(self.steps):
+          step.execute(context.scope())
+          context.release(set(range(index + 1)))
+          if step.abort:
+            break
+      finally:
+        context.release(set(range(len(self.steps))))
+    return self
+
+  def _analyse(self):
+    """
+    Determine for each step the previous steps it depends on.
+    """
+    dependencies = []
+    for index, step in enumerate(self.steps):
+      previous = set(range(index))
+      refs     = step.references
+      dependencies.append(previous if refs is None else refs & previous)
+    return dependencies
+
+  def _ready(self, pending, done, blocked):
+    """
+    Determine which pending steps can be executed, given the steps that are
+    done and the steps that are blocked, i.e. aborted or depending on one.
+    """
+    ready = []
+    for index in sorted(pending):
+      if self.dependencies[index] & blocked:
+        logger.info(f"⛔ not executing '{self.steps[index].name}'")
+        pending.remove(index)
+        blocked.add(index)
+      elif self.dependencies[index] <= done:
+        pending.remove(index)
+        ready.append(index)
+    return ready
+
+  def _execute_graph(self, context):
+    pending, done, blocked = set(range(len(self.steps))), set(), set()
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    workers = self.parallel if self.parallel is not True else len(self.steps)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+      running = {}
+      while pending or running:
+        for index in self._ready(pending, done, blocked):
+          step = self.steps[index]
+          running[pool.submit(propagate(step.execute, context.scope()))] = index
+        if not running:
           break
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+          index = running.pop(future)
+          future.result()
+          done.add(index)
+          context.release(done)
+          if self.steps[index].abort:
+            blocked.add(index)
+    return self
+
+  async def execute_async(self):
+    """
+    Run the entire script in a running event loop.
+    """
+    context = Context(self)
+    logger.info(f"▶ {self.description}")
+    with pooled():
+      try:
+        if self.parallel:
+          return await self._execute_graph_async(context)
+        for index, step in enumerate(self.steps):
+          await step.execute_async(context.scope())
+          context.release(set(range(index + 1)))
+          if step.abort:
+            break
+      finally:
+        context.release(set(range(len(self.steps))))
+    return self
+
+  async def _execute_graph_async(self, context):
+    import asyncio
+    pending, done, blocked = set(range(len(self.steps))), set(), set()
+    running = {}
+    while pending or running:
+      for index in self._ready(pending, done, blocked):
+        step = self.steps[index]
+        running[asyncio.ensure_future(step.execute_async(context.scope()))] = index
+      if not running:
+        break
+      finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+      for future in finished:
+        index = running.pop(future)
+        future.result()
+        done.add(index)
+        context.release(done)
+        if self.steps[index].abort:
+          blocked.add(index)
+    return self
+
+  def merge(self, other):
+    """
+    Adopt the runs and constants of another instance of this test, e.g. one
+    that was executed in another process.
+    """
+    for step, executed in zip(self.steps, other.steps):
+      new, step.runs = executed.runs[len(step.runs):], executed.runs
+      for run in new:
+        self._ran(step, run)
+    for name, constant in other.constants.items():
+      self.constants[name] = constant
+    return self
   
+  def _update(self, step):
+    # the status of a step might have changed
+    before, after = self._statuses.get(id(step)), step.status
+    if before == after:
+      return
+    self._statuses[id(step)] = after
+    previous, current = self._counts.update(before, after)
+    if previous != current and self.suite:
+      self.suite._update(previous, current)
+
+  def _ran(self, step, run):
+    # a step completed a run, notify the suite
+    if self.suite:
+      self.suite._notify("run", (self, step, run))
+
+  @property
+  def stats(self):
+    """
+    Latency statistics per phase of all steps.
+    """
+    stats = Stats()
+    for step in self.steps:
+      stats.merge(step.stats)
+    return stats
+
+  def capture(self, capture):
+    """
+    Apply a capture policy to the outputs of all steps.
+    """
+    for step in self.steps:
+      step.capture(capture)
+    return self
+
+  def trim(self, retention):
+    """
+    Apply a retention policy to the runs of all steps.
+    """
+    for step in self.steps:
+      step.trim(retention)
+    return self
+
   def reset(self):
     """
     Reset the test by removing al previous runs' information and constants.
@@ -229,19 +565,11 @@ class Test():
   
   @property
   def vars(self):
-    v = {}
-    # variables
-    if self._variables:
-      # expand when asked for...
-      v.update({
-        var : expand(value) for var, value in self._variables.items()
-      })
-    # constants
-    if self.constants:
-      v.update({ name: constant.value for name, constant in self.constants.items()})
-    # previous steps' output
-    v["STEP"] = [ mapped(step.last.raw) for step in self.steps if step.last ]
-    return v
+    """
+    Provide a (lazy) namespace with variables, constants and previous steps'
+    output.
+    """
+    return Context(self).scope()
   
   @property
   def results(self):
@@ -252,17 +580,106 @@ class Test():
   
   @property
   def overview(self):
-    return [ step.status for step in self.steps ]
+    return [ self._statuses[id(step)] for step in self.steps ]
+
+  @property
+  def counts(self):
+    """
+    The number of steps in each state.
+    """
+    return dict(self._counts.counts)
 
   @property
   def status(self):
-    return reduce_states(self.overview)
+    """
+    The aggregated status of all steps, maintained as their status changes.
+    """
+    return self._counts.status
   
+class Outputs():
+  """
+  provides the `STEP` variable: the last output of each step of a test. Outputs
+  are only mapped on first access, and only once for each run.
+  """
+  def __init__(self, steps):
+    self._steps  = steps
+    self._mapped = {}
+
+  def __len__(self):
+    return len(self._steps)
+
+  def __iter__(self):
+    for index, step in enumerate(self._steps):
+      if step.last:
+        yield self[index]
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [ self[i] for i in range(*index.indices(len(self))) ]
+    run = self._steps[index].last
+    if not run:
+      raise IndexError(f"step {index} has no output (yet)")
+    try:
+      cached_run, output = self._mapped[index]
+      if cached_run is run:
+        return output
+    except KeyError:
+      pass
+    output = mapped(run.value)
+    self._mapped[index] = (run, output)
+    return output
+
+  def release(self, index):
+    """
+    Releases the (raw and mapped) output of a step.
+    """
+    self._mapped.pop(index, None)
+    run = self._steps[index].last
+    if run:
+      run.release()
+
+class Context():
+  """
+  is the execution context of a test. It provides variables, constants and the
+  outputs of previous steps (`STEP`) by name. Variables are only evaluated when
+  they are referenced, and outputs are mapped once, when they are first used.
+  """
+  def __init__(self, test):
+    self.test     = test
+    self.outputs  = Outputs(test.steps)
+    self.released = set()
+
+  def __getitem__(self, name):
+    if name == "STEP":
+      return self.outputs
+    if self.test.constants and name in self.test.constants:
+      return self.test.constants[name].value
+    if name in self.test._compiled:
+      return evaluate(self.test._compiled[name])
+    raise KeyError(name)
+
+  def release(self, done):
+    """
+    Releases the outputs of steps that are done, once all steps that depend on
+    them are done too, so that large outputs aren't held longer than needed.
+    """
+    for index in done - self.released:
+      if self.test.dependents[index] <= done:
+        self.outputs.release(index)
+        self.released.add(index)
+
+  def scope(self):
+    """
+    Returns a fresh namespace, e.g. for a step, in which variables are
+    evaluated at most once.
+    """
+    return Namespace(self, work_dir=self.test.work_dir)
+
 class Step():
   def __init__(self, name=None,    func=None,     process=None, args=None,
                      asserts=None,
                      proceed=False, always=False, ignore=False, noretry=False,
-                     runs=None):
+                     runs=None, rollup=None):
     self.name    = name
     if not self.name:
       raise ValueError("a step needs a name")
@@ -271,13 +688,18 @@ class Step():
       raise ValueError("a step needs a function")
     self.process = process or []
     self.args    = args or {}
+    self._args   = compiled(self.args)
     self.asserts = asserts or []
+    self.test    = None
+    # incremented whenever runs are removed, or the ignore and noretry flags
+    # change, so that states that only persist the runs that were added notice
+    self.generation = 0
     self.proceed = proceed
     self.always  = always
     self.ignore  = ignore
     self.noretry = noretry
-    self.test    = None
     self.runs    = runs or []
+    self.rollup  = rollup or Rollup()
   
   @classmethod
   def from_dict(cls, d, test=None):
@@ -297,12 +719,13 @@ class Step():
     if not isinstance(runs, list):
       runs = [ runs ]
     runs    = [ Run.from_dict(run) for run in runs]
+    rollup  = Rollup.from_dict(d["rollup"]) if "rollup" in d else None
 
     return Step(
       name, func, process, args, asserts,
       d.get("continue", None), d.get("always", None), d.get("ignore", None),
       d.get("noretry", None),
-      runs
+      runs, rollup
     )
   
   def as_dict(self):
@@ -315,13 +738,96 @@ class Step():
       "continue" : self.proceed,
       "always"   : self.always,
       "ignore"   : self.ignore,
-      "noretry"  : self.ignore,
-      "runs"     : [ run.as_dict() for run in self.runs ]      
+      "noretry"  : self.noretry,
+      "runs"     : [ run.as_dict() for run in self.runs ],
+      "rollup"   : self.rollup.as_dict() if self.rollup else None
     })
   
   def reset(self):
-    self.runs = []
+    self.runs   = []
+    self.rollup = Rollup()
+    self.generation += 1
     return self
+
+  def capture(self, capture):
+    """
+    Apply a capture policy to the outputs of the runs.
+    """
+    for run in self.runs:
+      capture.apply(run)
+    return self
+
+  def trim(self, retention):
+    """
+    Apply a retention policy to the runs, rolling up the runs that are removed.
+    """
+    self.runs, trimmed = retention.apply(self.runs)
+    for run in trimmed:
+      self.rollup.add(run)
+    if trimmed:
+      self.generation += 1
+    return self
+
+  @property
+  def memory(self):
+    """
+    The memory of the step, as it was left by its last run.
+    """
+    return self.last.memory if self.last else {}
+
+  @contextlib.contextmanager
+  def _remembering(self, run):
+    # the run gets its own copy of the memory, that testers can access
+    run.memory = copy.deepcopy(self.memory)
+    token = _memory.set(run.memory)
+    try:
+      yield run.memory
+    finally:
+      _memory.reset(token)
+
+  @contextlib.contextmanager
+  def _profiling(self, run):
+    directory = _profile.get()
+    if not directory:
+      yield
+      return
+    import cProfile, os
+    profiler = cProfile.Profile()
+    try:
+      profiler.enable()
+    except ValueError:
+      # another profiler is active, e.g. in a concurrently executing step
+      logger.warning(f"⏱ can't profile '{self.name}'")
+      yield
+      return
+    try:
+      yield
+    finally:
+      profiler.disable()
+      os.makedirs(directory, exist_ok=True)
+      name = re.sub(r"[^\w.-]+", "_", self.name)
+      profiler.dump_stats(os.path.join(directory, f"{name}-{uuid.uuid4().hex[:8]}.prof"))
+
+  @property
+  def stats(self):
+    """
+    Latency statistics per phase of the runs that were performed.
+    """
+    stats = Stats()
+    for run in self.runs:
+      if not run.skipped:
+        stats.add(run.timings)
+    return stats
+
+  @property
+  def history(self):
+    """
+    A rollup of all runs, including those that were trimmed.
+    """
+    history = Rollup.from_dict(self.rollup.as_dict())
+    for run in self.runs:
+      history.add(run)
+    return history
   
   @property
   def status(self):
@@ -333,21 +839,16 @@ class Step():
     - failed : the last execution failed, and no retrying is allowed
     - pending: the last execution failed, the test will be retried
     """
-    if self.last:
-      if self.last.status == "success":
-        return "success"
-      if self.last.status == "failed" and self.ignore:
-        return "ignored"
-      if self.last.status == "failed" and self.noretry:
-        return "failed"
-      if self.last.status == "failed":
-        return "pending"
-    return "unknown"
+    return step_status(self.last.status if self.last else None, self.ignore, self.noretry)
 
   @property
   def result(self):
     if self.runs:
-      return self.runs[-1].as_dict()
+      result = self.runs[-1].as_dict()
+      # the memory and timings of a run are bookkeeping, not results
+      for key in [ "memory", "timings" ]:
+        result.pop(key, None)
+      return result
     return None
   
   @property
@@ -356,6 +857,20 @@ class Step():
       return self.runs[-1]
     return None
 
+  @property
+  def references(self):
+    """
+    The indices of the steps this step refers to using `STEP[n]`, or None if it
+    might refer to any step.
+    """
+    found = references(self._args)
+    for assertion in self.asserts:
+      if found is None:
+        break
+      more  = assertion.references
+      found = None if more is None else found | more
+    return found
+
   @property
   def abort(self):
     if self.runs:
@@ -364,37 +879,132 @@ class Step():
 
   def execute(self, vars=None):
     with Run() as run:
-      # if previous run as successful, skip
-      if self.last and self.last.status == "success" and not self.always:
-        logger.info(f"💤 skipping previously succesfull '{self.name}'")
-        run.status = self.last.status
-        run.raw    = self.last.raw
-        run.skipped = True
-      # if previous run failed, but we ignore it because it will always fail
-      elif self.last and self.last.status == "failed" and self.ignore:
-        logger.info(f"💤 ignoring previously failed '{self.name}'")
-        run.status = self.last.status
-        run.skipped = True
-      else:
+      if not self._skip(run):
         # actually execute it
         try:
-          args = { k : expand(v, vars) for k,v in self.args.items() }
-          run.output = postprocess(self.func(**args), self.process)
-          for a in self.asserts:
-            a(run.raw, vars)
-          run.status = "success"
-          logger.info(f"✅ {self.name}")
-        except AssertionError as e:
-          run.info = str(e)
-          run.status = "failed"
-          logger.info(f"🚨 {self.name} - {str(e)}")
+          with self._profiling(run):
+            scope  = scoped(vars)
+            with run.timed("expand"):
+              args = evaluate(self._args, scope)
+            with self._remembering(run), run.timed("call"):
+              output = self.func(**args)
+              if inspect.isawaitable(output):
+                # a coroutine tester, executed outside of an event loop
+                import asyncio
+                output = asyncio.run(output)
+            self._verify(run, output, scope)
         except Exception as e:
-          run.info = traceback.format_exc()
-          run.status = "failed"
-          logger.info(f"🛑 {self.name}")
-          logger.exception("unexpected exception...")
+          self._fail(run, e)
+      self.runs.append(run)
+    self._ran(run)
 
+  async def execute_async(self, vars=None):
+    """
+    Executes the step in a running event loop: coroutine testers are awaited
+    natively, synchronous ones are executed in the loop's default executor.
+    """
+    import asyncio
+    with Run() as run:
+      if not self._skip(run):
+        try:
+          scope = scoped(vars)
+          with run.timed("expand"):
+            args = evaluate(self._args, scope)
+          with self._remembering(run), run.timed("call"):
+            if inspect.iscoroutinefunction(self.func):
+              output = await self.func(**args)
+            else:
+              output = await asyncio.get_running_loop().run_in_executor(
+                None, propagate(functools.partial(self.func, **args))
+              )
+              if inspect.isawaitable(output):
+                # e.g. a decorated coroutine tester
+                output = await output
+          self._verify(run, output, scope)
+        except Exception as e:
+          self._fail(run, e)
       self.runs.append(run)
+    self._ran(run)
+
+  # changes to the runs and the ignore and noretry flags can change the status
+  # of the step, which is reported to the test
+
+  @property
+  def runs(self):
+    return self._runs
+
+  @runs.setter
+  def runs(self, runs):
+    self._runs = runs
+    self._update()
+
+  @property
+  def ignore(self):
+    return self._ignore
+
+  @ignore.setter
+  def ignore(self, ignore):
+    if ignore != getattr(self, "_ignore", ignore):
+      self.generation += 1
+    self._ignore = ignore
+    self._update()
+
+  @property
+  def noretry(self):
+    return self._noretry
+
+  @noretry.setter
+  def noretry(self, noretry):
+    if noretry != getattr(self, "_noretry", noretry):
+      self.generation += 1
+    self._noretry = noretry
+    self._update()
+
+  def _update(self):
+    if self.test:
+      self.test._update(self)
+
+  def _ran(self, run):
+    if self.test:
+      self.test._update(self)
+      self.test._ran(self, run)
+
+  def _skip(self, run):
+    # if previous run as successful, skip
+    if self.last and self.last.status == "success" and not self.always:
+      logger.info(f"💤 skipping previously succesfull '{self.name}'")
+      run.status = self.last.status
+      run.raw    = self.last.value
+      run.memory = self.last.memory
+      run.skipped = True
+      return True
+    # if previous run failed, but we ignore it because it will always fail
+    if self.last and self.last.status == "failed" and self.ignore:
+      logger.info(f"💤 ignoring previously failed '{self.name}'")
+      run.status = self.last.status
+      run.memory = self.last.memory
+      run.skipped = True
+      return True
+    return False
+
+  def _verify(self, run, output, scope):
+    with run.timed("process"):
+      run.output = postprocess(output, self.process)
+    for index, a in enumerate(self.asserts):
+      with run.timed(f"assert[{index}]"):
+        a(run.raw, scope)
+    run.status = "success"
+    logger.info(f"✅ {self.name}")
+
+  def _fail(self, run, e):
+    run.status = "failed"
+    if isinstance(e, AssertionError):
+      run.info = str(e)
+      logger.info(f"🚨 {self.name} - {str(e)}")
+    else:
+      run.info = traceback.format_exc()
+      logger.info(f"🛑 {self.name}")
+      logger.exception("unexpected exception...")
 
 class Assertion():
   def __init__(self, spec):
@@ -404,15 +1014,231 @@ class Assertion():
       cmd, args = spec.split(" ", 1)
       if cmd in [ "all", "any" ]:
         self._test = f"{cmd}( {args} )"
+    self._template = compiled(self._test)
+    # compiled once (and shared by all assertions with the same spec), with
+    # placeholders bound as variables, if possible
+    self._bound    = bound(self._test)
       
   def __str__(self):
     return self._spec
+
+  @property
+  def references(self):
+    """
+    The indices of the steps this assertion refers to using `STEP[n]`, or None
+    if it might refer to any step.
+    """
+    found = references(self._template)
+    if found is None or not self._template.dynamic:
+      return found
+    more = subscripts(self._test)
+    return None if more is None else found | more
   
   def __call__(self, raw_result, vars=None):
     result = mapped(raw_result)
     logger.debug(f"asserting '{result}' against '{self._test}'")
-    assertion = expand(self._test, vars)
-    assert eval(assertion, {"result": result}, vars), f"'{self._spec}' failed for result={raw_result}"
+    scope = scoped(vars)
+    if self._bound:
+      outcome = self._bound.evaluate(Namespace(scope, result=result), scope)
+    else:
+      # fall back to substituting placeholders in the source
+      assertion = self._template.substitute(scope)
+      code = compile_source(assertion) or compile(assertion, "<testman>", "eval")
+      outcome = eval(code, Namespace(scope, result=result))
+    assert outcome, f"'{self._spec}' failed for result={raw_result}"
+
+class Retention():
+  """
+  describes which runs of a step are kept: the last `last` runs, runs that
+  started less than `newer` seconds ago and, optionally, all failed runs. The
+  most recent run is always kept, since it determines the status of the step.
+  Without any criteria, all runs are kept.
+  """
+  def __init__(self, last=None, newer=None, failures=False):
+    self.last     = last
+    self.newer    = newer
+    self.failures = failures
+
+  def apply(self, runs, now=None):
+    """
+    Splits runs into those that are kept and those that are trimmed.
+    """
+    if not self.last and not self.newer and not self.failures:
+      return runs, []
+    now = now or utcnow()
+    kept, trimmed = [], []
+    for index, run in enumerate(runs):
+      recent = len(runs) - index <= max(self.last or 0, 1)
+      failed = self.failures and run.status == "failed"
+      young  = self.newer and run.start and \
+               (now - datetime.datetime.fromisoformat(run.start)).total_seconds() < self.newer
+      (kept if recent or failed or young else trimmed).append(run)
+    return kept, trimmed
+
+class Capture():
+  """
+  limits the size of the outputs that are kept with runs. Outputs that are
+  larger than `limit` bytes, serialized as JSON, are replaced by a reference,
+  with their size and SHA-256 digest, and either their first `limit`
+  characters or, given a `spill` directory, the name of a side file, named
+  after the digest, that holds the entire output.
+  """
+  MARKER = "$captured"
+
+  def __init__(self, limit=None, spill=None):
+    self.limit = limit
+    self.spill = spill
+
+  def apply(self, run):
+    """
+    Captures the output of a run, once.
+    """
+    if not self.limit or run.captured:
+      return run
+    import json, hashlib
+    run.captured = True
+    serialized   = json.dumps(run.output, default=str)
+    data         = serialized.encode()
+    if len(data) <= self.limit:
+      return run
+    digest    = hashlib.sha256(data).hexdigest()
+    reference = { "size" : len(data), "sha256" : digest }
+    if self.spill:
+      reference["file"] = self._spill(digest, data)
+    else:
+      reference["head"] = serialized[:self.limit]
+    run._output = { self.MARKER : reference }
+    return run
+
+  def _spill(self, digest, data):
+    # identical outputs share the same side file
+    import os
+    os.makedirs(self.spill, exist_ok=True)
+    filename = os.path.join(self.spill, f"{digest}.json")
+    if not os.path.exists(filename):
+      with open(f"{filename}.{uuid.uuid4().hex}", "wb") as fp:
+        fp.write(data)
+        temp = fp.name
+      os.replace(temp, filename)
+    return filename
+
+class Rollup():
+  """
+  summarises runs: the number of runs per status (and skipped runs), the
+  duration of the runs that were actually performed (min/avg/max, in seconds)
+  and the number of consecutive failures the runs end with, and when the first
+  of them started, so that retrying isn't affected by trimming runs.
+  """
+  def __init__(self, counts=None, performed=0, total=0.0, minimum=None, maximum=None,
+                     failing=0, since=None):
+    self.counts    = counts or {}
+    self.performed = performed
+    self.total     = total
+    self.minimum   = minimum
+    self.maximum   = maximum
+    self.failing   = failing
+    self.since     = since
+
+  def __bool__(self):
+    return bool(self.counts)
+
+  def add(self, run):
+    self.counts[run.status] = self.counts.get(run.status, 0) + 1
+    if run.skipped:
+      self.counts["skipped"] = self.counts.get("skipped", 0) + 1
+      return
+    if run.status == "failed":
+      if not self.failing:
+        self.since = run.start
+      self.failing += 1
+    else:
+      self.failing, self.since = 0, None
+    duration = run.duration
+    if duration is None:
+      return
+    self.performed += 1
+    self.total     += duration
+    self.minimum    = duration if self.minimum is None else min(self.minimum, duration)
+    self.maximum    = duration if self.maximum is None else max(self.maximum, duration)
+
+  @property
+  def runs(self):
+    return sum(count for status, count in self.counts.items() if status != "skipped")
+
+  @property
+  def average(self):
+    return self.total / self.performed if self.performed else None
+
+  @classmethod
+  def from_dict(cls, d):
+    latency = d.get("latency", {})
+    failing = d.get("failing", {})
+    return cls(
+      dict(d.get("counts", {})), latency.get("count", 0), latency.get("total", 0.0),
+      latency.get("min"), latency.get("max"),
+      failing.get("count", 0), failing.get("since")
+    )
+
+  def as_dict(self):
+    d = {
+      "counts"  : self.counts,
+      "latency" : {
+        "count" : self.performed,
+        "total" : self.total,
+        "min"   : self.minimum,
+        "avg"   : self.average,
+        "max"   : self.maximum
+      }
+    }
+    if self.failing:
+      d["failing"] = { "count" : self.failing, "since" : self.since }
+    return d
+
+class Stats():
+  """
+  aggregates timings per phase: the number of measurements and their total,
+  minimum, average and maximum duration (in seconds).
+  """
+  def __init__(self):
+    self.phases = {} # phase -> [ count, total, min, max ]
+
+  def add(self, timings):
+    for phase, seconds in timings.items():
+      self.measure(phase, seconds)
+    return self
+
+  def measure(self, phase, seconds, count=1, minimum=None, maximum=None):
+    current = self.phases.get(phase)
+    minimum = seconds if minimum is None else minimum
+    maximum = seconds if maximum is None else maximum
+    if current:
+      current[0] += count
+      current[1] += seconds
+      current[2]  = min(current[2], minimum)
+      current[3]  = max(current[3], maximum)
+    else:
+      self.phases[phase] = [ count, seconds, minimum, maximum ]
+    return self
+
+  def merge(self, other):
+    """
+    Adds the timings of other statistics, combining the timings of all
+    assertions into a single `assert` phase.
+    """
+    for phase, (count, total, minimum, maximum) in other.phases.items():
+      self.measure(re.sub(r"\[\d+\]$", "", phase), total, count, minimum, maximum)
+    return self
+
+  def as_dict(self):
+    return {
+      phase : {
+        "count" : count,
+        "total" : total,
+        "min"   : minimum,
+        "avg"   : total / count,
+        "max"   : maximum
+      } for phase, (count, total, minimum, maximum) in self.phases.items()
+    }
 
 class Run():
   def __init__(self):
@@ -423,11 +1249,59 @@ class Run():
     self.info    = None
     self.status  = "unknown"
     self.skipped = False
+    self.memory  = {}
+    self.timings = {} # phase -> seconds
+    self.captured = False
 
   @property
   def output(self):
     return self._output
 
+  @property
+  def value(self):
+    """
+    The output of the run: the raw output, as long as it is available, or else
+    the (captured) output, loaded from its side file if it was spilled.
+    """
+    if self.raw is not None:
+      return self.raw
+    if isinstance(self._output, dict) and Capture.MARKER in self._output:
+      reference = self._output[Capture.MARKER]
+      if "file" in reference:
+        import json
+        with open(reference["file"]) as fp:
+          return json.load(fp)
+      return reference.get("head")
+    return self._output
+
+  def release(self):
+    """
+    Releases the raw output, keeping only the (JSON serializable) output.
+    """
+    self.raw = None
+
+  @contextlib.contextmanager
+  def timed(self, phase):
+    """
+    Measures the duration of a phase of the run, using a monotonic clock.
+    """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.timings[phase] = self.timings.get(phase, 0.0) + time.perf_counter() - start
+
+  @property
+  def duration(self):
+    """
+    The duration of the run in seconds, if known.
+    """
+    if not self.start or not self.end:
+      return None
+    start = datetime.datetime.fromisoformat(self.start)
+    end   = datetime.datetime.fromisoformat(self.end)
+    return (end - start).total_seconds()
+
   @output.setter
   def output(self, output):
     self.raw = output
@@ -437,25 +1311,27 @@ class Run():
     self._output = output
 
   def __enter__(self):
-    self.start = datetime.datetime.utcnow().isoformat()
+    self.start = utcnow().isoformat()
     return self
 
   def __exit__(self, type, value, traceback):
-    self.end = datetime.datetime.utcnow().isoformat()
+    self.end = utcnow().isoformat()
 
   @classmethod
   def from_dict(cls, d):
     run = Run()
     run.start   = d["start"]
     run.end     = d["end"]
-    run.output  = d.get("output")
+    run._output = d.get("output")
     run.info    = d.get("info")
     run.status  = d["status"]
     run.skipped = d.get("skipped")
+    run.memory  = d.get("memory") or {}
+    run.timings = d.get("timings") or {}
     return run
 
   def as_dict(self):
-    return {
+    d = {
       "start"   : self.start,
       "end"     : self.end,
       "output"  : self.output,
@@ -463,20 +1339,8 @@ class Run():
       "status"  : self.status,
       "skipped" : self.skipped,
     }
-
-class WorkIn():
-  def __init__(self, work_dir=None):
-    self.work_dir = work_dir
-    self.cwd      = None
-
-  def __enter__(self):
-    if self.work_dir:
-      self.cwd = os.getcwd() 
-      os.chdir(self.work_dir)
-      logger.info(f"▶ in {self.work_dir}")
-    return self
-
-  def __exit__(self, type, value, traceback):
-    if self.cwd:
-      os.chdir(self.cwd)
-      logger.info(f"◀ in {self.cwd}")
+    if self.memory:
+      d["memory"] = self.memory
+    if self.timings:
+      d["timings"] = self.timings
+    return d
@@ -3,10 +3,14 @@ from fire import Fire
 from testman.cli import TestManCLI
 
 def cli():
+  testman = TestManCLI()
   try:
-    Fire(TestManCLI, name="testman")
+    Fire(testman, name="testman")
   except KeyboardInterrupt:
     pass
+  finally:
+    # persist all changes of the command chain at once
+    testman.flush()
 
 if __name__ == "__main__":
   cli()
@@ -1,9 +1,6 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from dotenv import load_dotenv, find_dotenv
-load_dotenv(find_dotenv(usecwd=True))
-
 import os
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL") or "DEBUG"
@@ -17,12 +14,29 @@ logging.basicConfig(level=LOG_LEVEL, format=FORMAT, datefmt=DATEFMT)
 formatter = logging.Formatter(FORMAT, DATEFMT)
 
 import json
-import yaml
-from pymongo import MongoClient
 
-from testman       import __version__, Suite, Test, Step, states
-from testman.util  import prune, load_ml
-from testman.state import State, YamlState, JsonState, MongoState
+from testman       import __version__, Suite, Test, Retention, Capture
+from testman.util  import load_ml
+from testman.state import State, YamlState, JsonState, MsgpackState, JournalState
+from testman.state import SqliteState, MongoState
+
+# heavier dependencies (yaml, pymongo, dotenv, asyncio) are only imported when
+# they are used, since the CLI is typically invoked often, e.g. from cron
+
+environment_loaded = False
+
+def load_environment():
+  """
+  Load environment variables from a .env file, once, when they are needed.
+  """
+  global environment_loaded
+  if environment_loaded:
+    return
+  from dotenv import load_dotenv, find_dotenv
+  load_dotenv(find_dotenv(usecwd=True))
+  if "LOG_LEVEL" in os.environ:
+    logging.getLogger().setLevel(os.environ["LOG_LEVEL"])
+  environment_loaded = True
 
 class TestManCLI():
   """
@@ -30,9 +44,12 @@ class TestManCLI():
   
   Typical usage:
       % testman load examples/mock.yaml execute status
+
+  Changes to the state are persisted once, at the end of the command chain,
+  using `flush`.
   """
   def __init__(self):
-    self.suites  = State()
+    self.suites  = State().defer()
     self._suite = "default"
   
   @property
@@ -44,6 +61,7 @@ class TestManCLI():
   
   def state(self, uri):
     def create_mongo_state(connection_string):
+      from pymongo import MongoClient
       server, db_name, collection_name = connection_string.rsplit("/", 2)
       client = MongoClient(server)
       db = client[db_name]
@@ -53,10 +71,55 @@ class TestManCLI():
     self.suites = {
       "yaml"   : YamlState,
       "json"   : JsonState,
+      "msgpack": MsgpackState,
+      "journal": JournalState,
+      "sqlite" : SqliteState,
       "mongodb": create_mongo_state
-    }[moniker](connection_string)
+    }[moniker](connection_string).defer()
     return self  
+
+  def defer(self, *, interval=None):
+    """
+    Persist changes at most every `interval` seconds, e.g. while watching,
+    instead of only at the end of the command chain.
+    """
+    self.suites.defer(interval=interval)
+    return self
+
+  def flush(self):
+    """
+    Persist all changes to the state.
+    """
+    self.suites.flush()
+    return self
   
+  def retain(self, *, last=None, newer=None, failures=False):
+    """
+    Set a retention policy for runs, applied when persisting: keep the `last`
+    N runs, runs newer than `newer` seconds and/or all `failures`. Runs that
+    are removed are rolled up into counters and latency statistics.
+    """
+    self.suites.retention = Retention(last=last, newer=newer, failures=failures)
+    return self
+
+  def capture(self, *, limit=None, spill=None):
+    """
+    Set a capture policy for outputs, applied when persisting: outputs larger
+    than `limit` bytes are truncated or, given a `spill` directory, stored in a
+    side file, named after their digest.
+    """
+    self.suites.capture = Capture(limit=limit, spill=spill)
+    return self
+
+  def profile(self, *, directory="profiles"):
+    """
+    Profile the execution of every step using cProfile, dumping the statistics
+    in the given directory.
+    """
+    import testman
+    testman.profile(directory)
+    return self
+
   def select(self, name):
     """
     Select the suite to work with.
@@ -80,6 +143,7 @@ class TestManCLI():
     Load a TestMan script/state encoded in JSON or YAML into the current suite.
     """
     logger.debug(f"loading test from '{script}'")
+    load_environment()
     
     self.suite.add(
       Test.from_dict(
@@ -94,15 +158,68 @@ class TestManCLI():
     List known 'suites' or 'tests'.
     """
     return {
-      "suites" : list(self.suites.keys()),
-      "tests"  : [ test.uid for test in self.suite.tests ]
-    }[what]
+      "suites" : lambda: list(self.suites.keys()),
+      "tests"  : lambda: [ test.uid for test in self.suite.tests ]
+    }[what]()
 
-  def execute(self):
+  def execute(self, *, workers=None, processes=False, asynchronous=False):
     """
-    Execute the currently selected suite.
+    Execute the currently selected suite, optionally using multiple workers
+    (threads or processes) to execute tests concurrently, or asynchronously on
+    an event loop, with at most `workers` tests in flight.
     """
-    self.suite.execute()
+    load_environment()
+    if asynchronous:
+      import asyncio
+      asyncio.run(self.suite.execute_async(concurrency=workers))
+    else:
+      self.suite.execute(workers=workers, processes=processes)
+    return self
+
+  def dispatch(self, *, queue="testman.queue", attempts=3, poll=1.0, timeout=None):
+    """
+    Execute the currently selected suite using workers: its tests are put on a
+    work `queue` (a SQLite database) and the runs of the executed tests are
+    merged into the suite. Tests are attempted at most `attempts` times.
+    """
+    from testman.workqueue import WorkQueue, dispatch
+    dispatch(
+      self.suite, WorkQueue(queue, attempts=attempts), poll=poll, timeout=timeout
+    )
+    return self
+
+  def worker(self, *, queue="testman.queue", name=None, lease=300, poll=1.0, idle=None):
+    """
+    Execute tests from a work `queue`, leasing each for `lease` seconds while
+    executing it, until no tests were queued for `idle` seconds, or forever.
+    """
+    from testman.workqueue import WorkQueue, work
+    load_environment()
+    work(WorkQueue(queue), worker=name, lease=lease, poll=poll, idle=idle)
+    return self
+
+  def watch(self, *, interval=60, backoff=2, max_delay=3600, deadline=None,
+                   forever=False, metrics=None, port=None):
+    """
+    Keep the state resident and keep executing the tests of all suites with
+    steps that are due, until all are done (or forever). Pending steps are
+    retried after `interval` seconds, multiplied by `backoff` for every
+    consecutive failure, up to `max_delay` seconds, and given up on after an
+    optional `deadline` (in seconds). Metrics can be written in the OpenMetrics
+    format to a `metrics` file and/or served on a local `port`.
+    """
+    from testman.scheduler import Scheduler
+    load_environment()
+    exporter = None
+    if metrics or port:
+      from testman.metrics import Metrics
+      exporter = Metrics()
+      if port:
+        exporter.serve(port)
+    Scheduler(
+      self.suites, interval=interval, backoff=backoff, max_delay=max_delay,
+      deadline=deadline, metrics=exporter, metrics_file=metrics
+    ).run(forever=forever)
     return self
 
   def drop(self, suite=None):
@@ -112,7 +229,7 @@ class TestManCLI():
     if suite is None:
       self.suites.drop(self._suite)
     elif suite == "all":
-      for suite in self.suites.keys():
+      for suite in list(self.suites.keys()):
         self.suites.drop(suite)
     else:
       self.suites.drop(suite)
@@ -123,11 +240,29 @@ class TestManCLI():
     """
     Provide summaries for all suites.
     """
-    return { suite.name : suite.summary for suite in self.suites.values() }
+    return self.suites.summaries
 
   @property
   def results(self):
-    return self.suite.results
+    """
+    Provide the most recent results of the currently selected suite.
+    """
+    try:
+      return self.suites.results(self._suite)
+    except KeyError:
+      return {}
+
+  @property
+  def stats(self):
+    """
+    Provide latency statistics per phase (argument expansion, function call,
+    postprocessing, assertions and persisting) of the currently selected suite
+    and each of its steps.
+    """
+    try:
+      return self.suites.stats(self._suite)
+    except KeyError:
+      return {}
 
   @property
   def results_as_json(self):
@@ -135,6 +270,7 @@ class TestManCLI():
 
   @property
   def results_as_yaml(self):
+    import yaml
     return yaml.dump(self.results)
 
   @property
@@ -149,6 +285,7 @@ class TestManCLI():
     """
     Dump currently selected suite as yaml.
     """
+    import yaml
     return yaml.dump(self.suite.as_dict(), indent=2)
 
   def __str__(self):
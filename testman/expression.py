@@ -0,0 +1,394 @@
+"""
+Compiled expressions.
+
+Strings in TestMan scripts can contain `{...}` placeholders, can refer to a
+file (prefix ~), can name a command (`module.function | filter`) or can be a
+Python expression. Parsing all of this on every evaluation is costly, so
+values are compiled once into `Expression` objects, holding their literal
+parts and code objects, and evaluated against a lazily built `Namespace`.
+
+>>> from testman.expression import compiled, evaluate
+>>> template = compiled({ "greeting" : "hello {NAME}" })
+>>> evaluate(template, { "NAME" : "world" })
+{'greeting': 'hello world'}
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import io
+import re
+import ast
+import tokenize
+import functools
+
+from testman.util import parse_command, postprocess, mapped
+from testman.util import lookup_function, Unresolvable
+
+PLACEHOLDER = re.compile(r"{([^}]+)}")
+
+# a command is a (dotted) name, optionally followed by filters
+COMMAND = re.compile(r"\s*[A-Za-z_][\w.]*\s*(\|.*)?", re.DOTALL)
+
+class Namespace(dict):
+  """
+  is the dict used as globals when evaluating expressions. Names are resolved
+  lazily, on first access, from the environment and the provided variables,
+  and are mapped once, so repeated references yield the same object. A
+  Namespace can be nested in another one, e.g. to add a `result`.
+
+  The optional work_dir is used to resolve relative file references. It is
+  inherited by nested namespaces.
+  """
+  def __init__(self, vars=None, work_dir=None, **kwargs):
+    super().__init__(**kwargs)
+    self._vars    = vars if vars is not None else {}
+    self.work_dir = work_dir
+    if not work_dir and isinstance(vars, Namespace):
+      self.work_dir = vars.work_dir
+
+  def __missing__(self, name):
+    if isinstance(self._vars, Namespace):
+      value = self._vars[name] # resolved and mapped by the enclosing namespace
+    else:
+      try:
+        value = os.environ[name]
+      except KeyError:
+        value = self._vars[name] # KeyError becomes a NameError in eval
+      value = mapped(value)
+    self[name] = value
+    return value
+
+def scoped(vars=None):
+  """
+  Returns the vars as a Namespace, wrapping them if they aren't one yet.
+  """
+  return vars if isinstance(vars, Namespace) else Namespace(vars)
+
+@functools.lru_cache(maxsize=4096)
+def compile_source(source):
+  """
+  Compiles a string to a code object, or returns None if it isn't valid
+  Python.
+  """
+  try:
+    return compile(source, "<testman>", "eval")
+  except (SyntaxError, ValueError):
+    return None
+
+def run_command(value):
+  """
+  Tries a (substituted) value as a command, returning its (postprocessed)
+  output, or the value itself if it isn't one.
+  """
+  if not isinstance(value, str) or not COMMAND.fullmatch(value):
+    return value
+  try:
+    func, process = parse_command(value, cache_failures=False)
+    return postprocess(func(), process)
+  except:
+    return value
+
+def eval_source(value, namespace):
+  """
+  Tries a value as a Python expression, returning its result, or the value
+  itself if it isn't one.
+  """
+  if isinstance(value, str):
+    code = compile_source(value)
+    if code:
+      try:
+        return eval(code, namespace)
+      except:
+        pass
+  return value
+
+def resolve(value, namespace):
+  """
+  Resolves a (substituted) value as a command and/or a Python expression, as
+  `expand` always did: first try it as a function, next try to eval it.
+  """
+  return eval_source(run_command(value), namespace)
+
+class Expression():
+  """
+  is a single compiled string value.
+  """
+  def __init__(self, source):
+    self.source  = source
+    self._parts  = []    # literal strings and (statement, code) tuples
+    self._whole  = False # the entire source is a single placeholder
+    self._static = None  # cached code of a source without placeholders
+    position = 0
+    for match in PLACEHOLDER.finditer(source):
+      if match.start() > position:
+        self._parts.append(source[position:match.start()])
+      stmt = match.group(1)
+      try:
+        code = compile(stmt, "<testman>", "eval")
+      except SyntaxError as e:
+        code = e # only report it when the expression is actually evaluated
+      self._parts.append((stmt, code))
+      position = match.end()
+    if position < len(source):
+      self._parts.append(source[position:])
+    self._whole = len(self._parts) == 1 and isinstance(self._parts[0], tuple)
+
+  def __str__(self):
+    return self.source
+
+  @property
+  def dynamic(self):
+    return any(isinstance(part, tuple) for part in self._parts)
+
+  def substitute(self, namespace):
+    """
+    Replaces all placeholders with their value in the namespace.
+    """
+    if not self.dynamic:
+      return self.source
+    values = []
+    for part in self._parts:
+      if isinstance(part, tuple):
+        stmt, code = part
+        if isinstance(code, SyntaxError):
+          raise code
+        value = eval(code, namespace)
+        if not value:
+          raise ValueError(f"unknown variable '{stmt}'")
+        values.append(value)
+      else:
+        values.append(part)
+    if self._whole:
+      return values[0]
+    return "".join(str(value) for value in values)
+
+  def evaluate(self, namespace):
+    # load from file (prefix ~), relative to the work_dir, if any
+    if self.source.startswith("~"):
+      filename = self.source[1:]
+      if namespace.work_dir:
+        filename = os.path.join(namespace.work_dir, filename)
+      with open(filename) as fp:
+        return compiled(fp.read()).evaluate(namespace)
+    if self.dynamic:
+      return resolve(self.substitute(namespace), namespace)
+    return self._resolve_static(namespace)
+
+  def _resolve_static(self, namespace):
+    # a constant source always compiles to the same code object and names the
+    # same command, which is looked up on every evaluation, since failures to
+    # resolve it are retried after a while
+    if self._static is None:
+      name, process = None, []
+      if COMMAND.fullmatch(self.source):
+        name, *process = [ part.strip() for part in self.source.split("|") ]
+      self._static = (compile_source(self.source), name, process)
+    code, name, process = self._static
+    func = lookup_function(name) if name else None
+    if func is not None and not isinstance(func, Unresolvable):
+      try:
+        return eval_source(postprocess(func(), process), namespace)
+      except:
+        pass
+    if code:
+      try:
+        return eval(code, namespace)
+      except:
+        pass
+    return self.source
+
+@functools.lru_cache(maxsize=4096)
+def _compiled_string(value):
+  return Expression(value)
+
+def compiled(value):
+  """
+  Compiles all strings in a (nested) value to Expressions.
+  """
+  if isinstance(value, dict):
+    return { k : compiled(v) for k, v in value.items() }
+  if isinstance(value, list):
+    return [ compiled(v) for v in value ]
+  if isinstance(value, str):
+    return _compiled_string(value)
+  return value
+
+def evaluate(value, vars=None):
+  """
+  Evaluates a compiled (nested) value, given variables.
+  """
+  namespace = scoped(vars)
+  if isinstance(value, dict):
+    return { k : evaluate(v, namespace) for k, v in value.items() }
+  if isinstance(value, list):
+    return [ evaluate(v, namespace) for v in value ]
+  if isinstance(value, Expression):
+    return value.evaluate(namespace)
+  return value
+
+@functools.lru_cache(maxsize=4096)
+def string_spans(source):
+  """
+  Returns the (start, end, token) offsets of all string literals in a source.
+  """
+  lines   = source.splitlines(keepends=True)
+  offsets = [ 0 ]
+  for line in lines:
+    offsets.append(offsets[-1] + len(line))
+  spans = []
+  for token in tokenize.generate_tokens(io.StringIO(source).readline):
+    if token.type == tokenize.STRING:
+      (srow, scol), (erow, ecol) = token.start, token.end
+      spans.append((offsets[srow-1] + scol, offsets[erow-1] + ecol, token.string))
+  return spans
+
+class Bound():
+  """
+  is a Python expression with placeholders, compiled once, with the
+  placeholders bound as variables instead of being substituted into the source.
+  Placeholders in string literals become string concatenations. Elsewhere, as
+  with substitution, their (textual) values are taken as code, see `as_code`.
+  
+  >>> Bound('x == "id-{ID}"').source
+  "x == ('id-' + str(__placeholder_0__) + '')"
+  """
+  def __init__(self, source):
+    self.placeholders = []
+    transformed = []
+    position    = 0
+    spans       = string_spans(source)
+    for match in PLACEHOLDER.finditer(source):
+      overlapping = [
+        (start, end) for start, end, _ in spans
+        if match.start() < end and start < match.end()
+      ]
+      if overlapping and not (overlapping[0][0] <= match.start() and \
+                              match.end() <= overlapping[0][1]):
+        raise ValueError(f"placeholder '{match.group(0)}' spans string literals")
+    for start, end, literal in spans + [ (len(source), len(source), None) ]:
+      transformed.append(self._bind(source[position:start]))
+      if literal is not None:
+        transformed.append(self._bind_literal(literal))
+      position = end
+    self.source = "".join(transformed)
+    self.code   = compile(self.source, "<testman>", "eval")
+
+  def _placeholder(self, stmt, code=True):
+    name = f"__placeholder_{len(self.placeholders)}__"
+    self.placeholders.append((name, stmt, compile(stmt, "<testman>", "eval"), code))
+    return name
+
+  def _bind(self, code):
+    return PLACEHOLDER.sub(lambda match: f"({self._placeholder(match.group(1))})", code)
+
+  def _bind_literal(self, literal):
+    if not PLACEHOLDER.search(literal):
+      return literal
+    prefix = literal[:len(literal) - len(literal.lstrip("rRbBuUfF"))]
+    if "f" in prefix.lower() or "b" in prefix.lower():
+      raise ValueError(f"can't bind placeholders in {literal}")
+    value = ast.literal_eval(literal)
+    parts = []
+    position = 0
+    for match in PLACEHOLDER.finditer(value):
+      parts.append(repr(value[position:match.start()]))
+      parts.append(f"str({self._placeholder(match.group(1), code=False)})")
+      position = match.end()
+    parts.append(repr(value[position:]))
+    return "(" + " + ".join(parts) + ")"
+
+  def evaluate(self, namespace, scope=None):
+    """
+    Evaluates the expression in a namespace, binding its placeholders first,
+    optionally evaluated in a different scope.
+    """
+    for name, stmt, code, inline in self.placeholders:
+      value = eval(code, namespace if scope is None else scope)
+      if not value:
+        raise ValueError(f"unknown variable '{stmt}'")
+      namespace[name] = as_code(value, namespace) if inline else value
+    return eval(self.code, namespace)
+
+def as_code(value, namespace):
+  """
+  Provides the value of a placeholder in code, as if its text was substituted:
+  a string is taken as a Python literal, or else evaluated as an expression,
+  raising the same errors, e.g. a NameError. Other values are kept.
+
+  >>> as_code("3", {})
+  3
+  """
+  if not isinstance(value, str):
+    return value
+  try:
+    return ast.literal_eval(value)
+  except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+    pass
+  return eval(compile_source(value) or compile(value, "<testman>", "eval"), namespace)
+
+@functools.lru_cache(maxsize=4096)
+def bound(source):
+  """
+  Returns a (cached) Bound expression for a source, or None if its placeholders
+  can't be bound, e.g. because they span parts of string literals.
+  """
+  try:
+    return Bound(source)
+  except (SyntaxError, ValueError, tokenize.TokenError, IndentationError):
+    return None
+
+@functools.lru_cache(maxsize=4096)
+def subscripts(source, name="STEP"):
+  """
+  Returns the constant, non-negative indices used to subscript `name` in a
+  Python source string, or None if `name` is used in any other way (or if the
+  source can't be parsed), meaning that it might refer to any index.
+  """
+  try:
+    tree = ast.parse(source.strip(), mode="eval")
+  except SyntaxError:
+    return None if name in source else frozenset()
+  indices = set()
+  parents = { child : node for node in ast.walk(tree) for child in ast.iter_child_nodes(node) }
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Name) and node.id == name:
+      parent = parents.get(node)
+      if isinstance(parent, ast.Subscript) and parent.value is node and \
+         isinstance(parent.slice, ast.Constant) and \
+         isinstance(parent.slice.value, int) and parent.slice.value >= 0:
+        indices.add(parent.slice.value)
+      else:
+        return None
+  return frozenset(indices)
+
+def references(value, name="STEP"):
+  """
+  Returns the constant indices used to subscript `name` in a compiled (nested)
+  value, or None if it might refer to any index.
+  """
+  if isinstance(value, dict):
+    value = list(value.values())
+  if isinstance(value, list):
+    indices = set()
+    for v in value:
+      found = references(v, name)
+      if found is None:
+        return None
+      indices |= found
+    return indices
+  if isinstance(value, Expression):
+    if value.source.startswith("~"):
+      return None # the file's content is only known when evaluating
+    sources = [ part[0] for part in value._parts if isinstance(part, tuple) ]
+    if not value.dynamic:
+      sources.append(value.source)
+    indices = set()
+    for source in sources:
+      found = subscripts(source, name)
+      if found is None:
+        return None
+      indices |= found
+    return indices
+  return set()
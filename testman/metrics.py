@@ -0,0 +1,190 @@
+"""
+OpenMetrics (Prometheus) export of the status and latencies of suites.
+
+Instead of recomputing summaries over the entire state, a `Metrics` exporter
+keeps counters, gauges and histograms that are updated as runs complete, and
+renders them in the OpenMetrics text format, to a file or over HTTP:
+
+  # TYPE testman_runs counter
+  testman_runs_total{suite="mock",status="success"} 7
+  # TYPE testman_steps gauge
+  testman_steps{suite="mock",status="pending"} 1
+  # TYPE testman_step_latency_seconds histogram
+  testman_step_latency_seconds_bucket{suite="mock",le="0.005"} 6
+  ...
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import threading
+
+from testman import states
+
+BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0 )
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+def escape(value):
+  return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def labels(**kwargs):
+  return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in kwargs.items()) + "}"
+
+class Histogram():
+  def __init__(self, buckets=BUCKETS):
+    self.buckets = buckets
+    self.counts  = [ 0 ] * len(buckets)
+    self.count   = 0
+    self.sum     = 0.0
+
+  def observe(self, value):
+    for index, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[index] += 1
+    self.count += 1
+    self.sum   += value
+
+class Metrics():
+  """
+  maintains metrics for the suites it tracks:
+  - testman_runs_total: the number of performed runs per status
+  - testman_steps: the number of steps per status
+  - testman_step_latency_seconds: a histogram of the latency of performed runs
+  """
+  def __init__(self, buckets=BUCKETS):
+    self.buckets  = buckets
+    self.runs     = {} # suite -> { status : count }
+    self.steps    = {} # suite -> { status : count }
+    self.latency  = {} # suite -> Histogram
+    self._status  = {} # suite -> { id(step) : status }
+    self._tracked = set()
+    self._lock    = threading.Lock()
+
+  def track(self, suite):
+    """
+    Start tracking a suite, updating the metrics as its runs complete.
+    """
+    if suite.name in self._tracked:
+      return self
+    self._tracked.add(suite.name)
+    with self._lock:
+      self.runs.setdefault(suite.name, { "success" : 0, "failed" : 0 })
+      self.latency.setdefault(suite.name, Histogram(self.buckets))
+      self._count(suite)
+    suite.on_change(lambda event, context: self._changed(suite, event, context))
+    return self
+
+  def refresh(self, suite):
+    """
+    Recount the steps of a suite per status, e.g. after changing them directly.
+    """
+    with self._lock:
+      self._count(suite)
+    return self
+
+  def _count(self, suite):
+    statuses = {
+      id(step) : step.status for test in suite.tests for step in test.steps
+    }
+    self._status[suite.name] = statuses
+    counts = { status : 0 for status in states }
+    for status in statuses.values():
+      counts[status] += 1
+    self.steps[suite.name] = counts
+
+  def _changed(self, suite, event, context):
+    with self._lock:
+      if event == "run":
+        _, step, run = context
+        self._observe(suite, step, run)
+      elif event != "execute":
+        # the structure or the runs of the suite changed, e.g. by a reset
+        self._count(suite)
+
+  def _observe(self, suite, step, run):
+    statuses = self._status[suite.name]
+    counts   = self.steps[suite.name]
+    before   = statuses.get(id(step))
+    after    = step.status
+    if before != after:
+      if before:
+        counts[before] -= 1
+      counts[after]        += 1
+      statuses[id(step)]    = after
+    if run.skipped:
+      return
+    counts = self.runs[suite.name]
+    counts[run.status] = counts.get(run.status, 0) + 1
+    latency = sum(run.timings.values()) if run.timings else run.duration
+    if latency is not None:
+      self.latency[suite.name].observe(latency)
+
+  def render(self):
+    """
+    Renders the metrics in the OpenMetrics text format.
+    """
+    with self._lock:
+      lines = [
+        "# TYPE testman_runs counter",
+        "# HELP testman_runs Performed runs of steps, per status.",
+      ]
+      for suite, counts in self.runs.items():
+        for status, count in counts.items():
+          lines.append(f"testman_runs_total{labels(suite=suite, status=status)} {count}")
+      lines += [
+        "# TYPE testman_steps gauge",
+        "# HELP testman_steps Steps, per status.",
+      ]
+      for suite, counts in self.steps.items():
+        for status, count in counts.items():
+          lines.append(f"testman_steps{labels(suite=suite, status=status)} {count}")
+      lines += [
+        "# TYPE testman_step_latency_seconds histogram",
+        "# UNIT testman_step_latency_seconds seconds",
+        "# HELP testman_step_latency_seconds Latency of performed runs of steps.",
+      ]
+      name = "testman_step_latency_seconds"
+      for suite, histogram in self.latency.items():
+        for bound, count in zip(histogram.buckets, histogram.counts):
+          lines.append(f"{name}_bucket{labels(suite=suite, le=bound)} {count}")
+        lines.append(f"{name}_bucket{labels(suite=suite, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_count{labels(suite=suite)} {histogram.count}")
+        lines.append(f"{name}_sum{labels(suite=suite)} {histogram.sum}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+  def write(self, filename):
+    """
+    Writes the metrics to a file, e.g. for a node exporter's textfile collector,
+    replacing it atomically.
+    """
+    temp = f"{filename}.{os.getpid()}.tmp"
+    with open(temp, "w") as fp:
+      fp.write(self.render())
+    os.replace(temp, filename)
+    return self
+
+  def serve(self, port, host="127.0.0.1"):
+    """
+    Serves the metrics over HTTP, from a background thread. Returns the server.
+    """
+    import http.server
+    metrics = self
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def do_GET(self):
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"📈 serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
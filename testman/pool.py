@@ -0,0 +1,148 @@
+"""
+Pooled connections for testers.
+
+Testers that connect to a server, e.g. to send or receive an email, would set
+up a connection (and its TLS handshake and login) on every call. While a suite
+is executed, a `Pool` is active, from which testers can obtain connections,
+keyed by server and credentials, that are reused by all steps and tests of the
+suite and closed when its execution ends.
+
+>>> from testman.pool import pooled, connection
+>>> with pooled():
+...   with connection(("demo", 1), open=lambda: object()) as first:
+...     pass
+...   with connection(("demo", 1), open=lambda: object()) as second:
+...     pass
+...   first is second
+True
+
+Outside of a pool, a connection is opened and closed on every use.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+import functools
+import contextlib
+import contextvars
+
+class Pool():
+  """
+  keeps idle connections per key. A connection is only used by one step at a
+  time, so concurrently executing steps each get their own.
+  """
+  def __init__(self):
+    self._idle   = {} # key -> [ idle connections ]
+    self._closes = {} # id(connection) -> (connection, close function)
+    self._lock   = threading.Lock()
+    self.opened  = 0
+
+  def acquire(self, key, open, close=None, check=None):
+    """
+    Returns an idle connection for the key, if one is available and passes the
+    optional check, or opens a new one.
+    """
+    while True:
+      with self._lock:
+        idle = self._idle.get(key)
+        connection = idle.pop() if idle else None
+      if connection is None:
+        break
+      try:
+        if not check or check(connection):
+          return connection
+      except Exception:
+        pass
+      logger.debug(f"🔌 discarding stale connection for {key[0]}")
+      self.discard(connection)
+    connection = open()
+    with self._lock:
+      self._closes[id(connection)] = (connection, close)
+      self.opened += 1
+    return connection
+
+  def release(self, key, connection):
+    """
+    Returns a connection to the pool, for reuse.
+    """
+    with self._lock:
+      self._idle.setdefault(key, []).append(connection)
+
+  def discard(self, connection):
+    """
+    Closes a connection, e.g. when it failed, so that it isn't reused.
+    """
+    with self._lock:
+      _, close = self._closes.pop(id(connection), (None, None))
+    if close:
+      try:
+        close(connection)
+      except Exception:
+        pass
+
+  def close(self):
+    """
+    Closes all connections.
+    """
+    with self._lock:
+      connections = [ connection for connection, _ in self._closes.values() ]
+      self._idle.clear()
+    for connection in connections:
+      self.discard(connection)
+
+_current = contextvars.ContextVar("testman.pool", default=None)
+
+def current():
+  """
+  Returns the active pool, or None.
+  """
+  return _current.get()
+
+@contextlib.contextmanager
+def pooled():
+  """
+  Activates a pool for the duration of the block, unless one is already active,
+  and closes all of its connections at the end.
+  """
+  pool = current()
+  if pool:
+    yield pool
+    return
+  pool  = Pool()
+  token = _current.set(pool)
+  try:
+    yield pool
+  finally:
+    _current.reset(token)
+    pool.close()
+
+@contextlib.contextmanager
+def connection(key, open, close=None, check=None):
+  """
+  Provides a connection for the key, from the active pool, if any. A connection
+  that raises an exception is discarded.
+  """
+  pool = current()
+  if not pool:
+    connection = open()
+    try:
+      yield connection
+    finally:
+      if close:
+        close(connection)
+    return
+  connection = pool.acquire(key, open, close=close, check=check)
+  try:
+    yield connection
+  except BaseException:
+    pool.discard(connection)
+    raise
+  pool.release(key, connection)
+
+def propagate(func, *args):
+  """
+  Returns a callable that executes func in a copy of the current context, e.g.
+  in a thread, which doesn't inherit it, so that it uses the same pool.
+  """
+  return functools.partial(contextvars.copy_context().run, func, *args)
@@ -0,0 +1,189 @@
+"""
+Scheduler for long-running, resident use of TestMan.
+
+Instead of invoking the CLI repeatedly, reloading the state and executing
+entire suites each time, the scheduler keeps the state in memory and only
+executes tests that have steps that are due: steps that haven't been executed
+yet, and pending steps, which are retried with an exponential backoff. Pending
+steps that don't succeed before their deadline are given up on.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+import datetime
+
+from testman.util import utcnow
+from testman.pool import pooled
+
+class Scheduler():
+  """
+  executes the tests of all suites in a state, until all steps are done.
+  
+  A pending step is retried `interval` seconds after its last run, multiplied
+  by `backoff` for every consecutive failure, up to `max_delay` seconds. If a
+  `deadline` (in seconds since the first failure) passes, the step is no longer
+  retried and marked failed. Failures that were trimmed by a retention policy
+  still count, since they are rolled up. Suites that changed in a tick are marked changed,
+  and deferred changes are flushed before sleeping.
+  """
+  def __init__(self, state, interval=60, backoff=2, max_delay=3600,
+                     deadline=None, clock=utcnow, sleep=time.sleep,
+                     metrics=None, metrics_file=None):
+    self.state     = state
+    self.interval  = interval
+    self.backoff   = backoff
+    self.max_delay = max_delay
+    self.deadline  = deadline
+    self.clock     = clock
+    self.sleep     = sleep
+    self.metrics   = metrics
+    self.metrics_file = metrics_file
+
+  def failures(self, step):
+    """
+    Returns the performed runs of a step that failed consecutively, most recent
+    last.
+    """
+    failed = []
+    for run in reversed(step.runs):
+      if run.skipped:
+        continue
+      if run.status != "failed":
+        break
+      failed.insert(0, run)
+    return failed
+
+  def streak(self, step):
+    """
+    Returns the number of consecutive failures of a step, and when the first of
+    them started, including failed runs that were trimmed and rolled up.
+    """
+    failures = self.failures(step)
+    if not failures:
+      return 0, None
+    count, since = len(failures), failures[0].start
+    if step.rollup.failing and \
+       len(failures) == len([ run for run in step.runs if not run.skipped ]):
+      # the streak started before the runs that were kept
+      count += step.rollup.failing
+      since  = step.rollup.since
+    return count, since
+
+  def due(self, step):
+    """
+    Returns when a step should be executed, or None if it is done.
+    """
+    status = step.status
+    if status == "unknown":
+      return datetime.datetime.min
+    if status != "pending":
+      return None
+    count, _ = self.streak(step)
+    if not count:
+      return datetime.datetime.min
+    delay = min(self.interval * self.backoff ** (count - 1), self.max_delay)
+    return datetime.datetime.fromisoformat(step.last.end) + \
+           datetime.timedelta(seconds=delay)
+
+  def blocked(self, test):
+    """
+    Returns the indices of the steps of a test that are no longer executed,
+    because a step before them, or one they depend on when executed in
+    parallel, failed definitively or ignored, without `continue`.
+    """
+    blocked = set()
+    for index, step in enumerate(test.steps):
+      if test.parallel and test.dependencies[index] & blocked or \
+         not test.parallel and blocked:
+        blocked.add(index)
+      elif step.abort and step.status in ("ignored", "failed"):
+        blocked.add(index)
+    return blocked
+
+  def upcoming(self, test):
+    """
+    Returns when a test should be executed, or None if all its steps are done.
+    Steps following a pending step are only executed when it is retried, and
+    never after a step failed definitively. Blocked steps count as done.
+    """
+    if any(step.status == "failed" for step in test.steps):
+      return None
+    blocked = self.blocked(test)
+    steps   = [ step for index, step in enumerate(test.steps) if index not in blocked ]
+    pending = [ self.due(step) for step in steps if step.status == "pending" ]
+    if pending:
+      return min(pending)
+    if any(step.status == "unknown" for step in steps):
+      return datetime.datetime.min
+    return None
+
+  def expired(self, step, now):
+    """
+    Determine if a pending step passed its deadline.
+    """
+    if not self.deadline or step.status != "pending":
+      return False
+    count, since = self.streak(step)
+    if not count:
+      return False
+    first = datetime.datetime.fromisoformat(since)
+    return (now - first).total_seconds() > self.deadline
+
+  def tick(self):
+    """
+    Executes all tests with due steps, gives up on expired steps and persists
+    the suites that changed. Returns when the next step is due, or None if all
+    steps are done.
+    """
+    upcoming = []
+    for name in list(self.state.keys()):
+      suite   = self.state[name]
+      if self.metrics:
+        self.metrics.track(suite)
+      with pooled():
+        changed = self._tick(suite, upcoming)
+      if changed:
+        self.state.changed(name)
+    if self.metrics and self.metrics_file:
+      self.metrics.write(self.metrics_file)
+    return min(upcoming) if upcoming else None
+
+  def _tick(self, suite, upcoming):
+    changed = False
+    for test in suite.tests:
+      now = self.clock()
+      for step in test.steps:
+        if self.expired(step, now):
+          logger.info(f"⌛ giving up on '{step.name}'")
+          step.noretry = True
+          changed      = True
+          if self.metrics:
+            self.metrics.refresh(suite)
+      due = self.upcoming(test)
+      if due and due <= now:
+        test.execute()
+        changed = True
+        due     = self.upcoming(test)
+      if due:
+        upcoming.append(due)
+    return changed
+
+  def run(self, forever=False):
+    """
+    Keep executing due tests, until all steps are done, or forever.
+    """
+    while True:
+      upcoming = self.tick()
+      # persist deferred changes before going idle
+      self.state.flush()
+      if upcoming is None and not forever:
+        return self
+      if upcoming is None:
+        delay = self.interval
+      else:
+        delay = (upcoming - self.clock()).total_seconds()
+      if delay > 0:
+        logger.debug(f"💤 sleeping {delay:.1f}s")
+        self.sleep(min(delay, self.max_delay))
@@ -1,12 +1,17 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from collections import UserDict
+import os
+import time
+import threading
+import contextlib
+from collections import UserDict, Counter
 
-import yaml
 import json
 
-from testman import Test, Suite
+# yaml and sqlite3 are imported when their state is used, to keep startup fast
+
+from testman import Test, Suite, Run, Stats, summarize, step_status, reduce_states
 
 class State(UserDict):
   """
@@ -50,6 +55,54 @@ class State(UserDict):
   }
   """
   
+  retention = None
+  capture   = None
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.timings   = {} # name -> Stats of persisting the suite
+    self._dirty    = {} # names of changed suites, in order, that aren't persisted
+    self._deferred = False
+    self._interval = None
+    self._flushed  = time.monotonic()
+
+  # suites are loaded lazily: `data` only holds the suites that have been
+  # accessed (or added), subclasses provide the names of all stored suites and
+  # load a suite's object graph on first access.
+
+  def _names(self):
+    """
+    Provide the names of all suites, including those that aren't loaded yet.
+    """
+    return list(self.data)
+
+  def _load_suite(self, name):
+    """
+    Load a stored suite.
+    """
+    raise KeyError(name)
+
+  def _stored(self, name):
+    """
+    Provide the stored, marshalled form of a suite that isn't loaded yet. Only
+    the status of the suite and of its tests and steps is required.
+    """
+    return self._load_suite(name).as_dict()
+
+  def __iter__(self):
+    return iter(self._names())
+
+  def __len__(self):
+    return len(self._names())
+
+  def __contains__(self, name):
+    return name in self.data or name in self._names()
+
+  def __missing__(self, name):
+    suite = self._load_suite(name)
+    self.add(suite)
+    return suite
+
   @property
   def list(self):
     return list(self.keys())
@@ -59,77 +112,840 @@ class State(UserDict):
     # TODO: look into more entry points to setup callback
     # - __setitem__
     # - update
-    suite.on_change((lambda evt, ctx: self.persist(suite.name)))
+    suite.on_change((lambda evt, ctx: self._on_change(suite.name, evt)))
+    return self
+
+  def _on_change(self, name, event):
+    # completed runs are persisted once the execution of the suite is done
+    if event != "run":
+      self.changed(name)
+
+  def defer(self, interval=None):
+    """
+    Defer persisting changes: changed suites are marked dirty and persisted all
+    at once by `flush`, or when a change happens `interval` seconds or more
+    after the previous flush.
+    """
+    self._deferred = True
+    self._interval = interval
+    return self
+
+  def changed(self, name):
+    """
+    Handle a change to a suite: mark it dirty and, unless persisting is
+    deferred, flush it.
+    """
+    self._dirty[name] = True
+    if not self._deferred or \
+       self._interval is not None and \
+       time.monotonic() - self._flushed >= self._interval:
+      self.flush()
+
+  @property
+  def dirty(self):
+    return list(self._dirty)
+
+  def flush(self):
+    """
+    Persist all dirty suites, after applying the retention and capture
+    policies, if any.
+    """
+    names = list(self._dirty)
+    self._dirty.clear()
+    self._flushed = time.monotonic()
+    if not names:
+      return self
+    for name in names:
+      if name in self.data:
+        if self.capture:
+          self.data[name].capture(self.capture)
+        if self.retention:
+          self.data[name].trim(self.retention)
+    start = time.perf_counter()
+    self.persist_all(names)
+    elapsed = (time.perf_counter() - start) / len(names)
+    for name in names:
+      if name in self.data:
+        self.timings.setdefault(name, Stats()).measure("persist", elapsed)
     return self
 
-  def drop(self, suite):
-    del self[suite.name]
-    self.persist()
+  def stats(self, name):
+    """
+    Provide latency statistics per phase for a suite and for each of its steps,
+    including the time it took to persist the suite (in this process).
+    """
+    suite  = self[name]
+    phases = suite.stats.merge(self.timings.get(name, Stats()))
+    return {
+      "phases" : phases.as_dict(),
+      "steps"  : {
+        test.uid : { step.name : step.stats.as_dict() for step in test.steps }
+        for test in suite.tests
+      }
+    }
+
+  def drop(self, name):
+    del self[name]
+    self.persist(name)
     return self
 
   @property
   def summary(self):
-    return { name : suite.status for name, suite in self.items() }
+    """
+    Provide the status of each suite, without loading suites.
+    """
+    return {
+      name : self.data[name].status if name in self.data
+             else self._stored(name).get("status", "unknown")
+      for name in self._names()
+    }
 
-  def persist(self, suite):
+  @property
+  def summaries(self):
+    """
+    Provide the summary of each suite, without loading suites.
+    """
+    def summaries(suite):
+      return {
+        test["uid"] : summarize(Counter(
+          step.get("status", "unknown") for step in test.get("steps", [])
+        )) for test in suite.get("tests", [])
+      }
+    return {
+      name : self.data[name].summary if name in self.data
+             else summaries(self._stored(name))
+      for name in self._names()
+    }
+
+  def results(self, name):
+    """
+    Provide the most recent results of a suite.
+    """
+    return self[name].results
+
+  def persist(self, name):
     pass
 
-class FileState(State):
+  def persist_all(self, names):
+    """
+    Persist several suites. By default, they are persisted one by one.
+    """
+    for name in names:
+      if name in self.data:
+        self.persist(name)
+
+class MarshalledState(State):
+  """
+  Base class for states that read all suites in their marshalled form, and only
+  unmarshall a suite into its object graph when it is accessed.
+  """
+  def __init__(self):
+    super().__init__()
+    self._raw = {} # name -> marshalled suite, None once it has been loaded
+
+  def _names(self):
+    return list(self._raw) + [ name for name in self.data if not name in self._raw ]
+
+  def _load_suite(self, name):
+    if self._raw.get(name) is None:
+      raise KeyError(name)
+    return Suite.from_dict(self._raw[name])
+
+  def _stored(self, name):
+    return self._raw[name]
+
+  def _marshalled(self, name):
+    return self.data[name].as_dict() if name in self.data else self._raw[name]
+
+  def add(self, suite):
+    super().add(suite)
+    if suite.name in self._raw:
+      self._raw[suite.name] = None # keep the position of the suite
+    return self
+
+  def forget(self, name):
+    if not name in self:
+      raise KeyError(name)
+    self.data.pop(name, None)
+    self._raw.pop(name, None)
+
+class FileState(MarshalledState):
   """
-  Base class for file-based states.
+  Base class for file-based states. The loader reads all suites from a file,
+  the saver writes suites one by one to a file, so that they don't all have to
+  be marshalled at once. The suites are written to a temporary file, that
+  replaces the state file atomically once all suites were written.
+
+  Several processes can share a state file: writing it is serialized using an
+  advisory lock on `<filename>.lock`, and if another process replaced the file
+  since it was read, the runs it added are merged into the loaded suites, and
+  its versions of the other suites are adopted, before writing it.
+
+  Given an encoder, suites are encoded one by one into chunks, which are
+  cached, so that only the suites that changed are encoded again, and the
+  saver writes the chunks.
   """
-  def __init__(self, filename, loader=None, saver=None):
+  def __init__(self, filename, loader=None, saver=None, binary=False, encoder=None):
     super().__init__()
     self.filename = filename
-    self._loader = loader
-    self._saver  = saver
+    self._loader  = loader
+    self._saver   = saver
+    self._binary  = binary
+    self._encoder = encoder
+    self._chunks  = {}   # name -> encoded suite
+    self._seen    = {}   # name -> { (test uid, step index) : { run keys } }
+    self._dropped = set()
     self._load()
 
-  def _load(self):
-    logger.info("💾 loading")
+  def _read(self):
     try:
-      with open(self.filename) as fp:
-        self.data = {}
-        suites = self._loader(fp)
-        if suites:
-          for suite in suites:
-            self.add(Suite.from_dict(suite))
+      with open(self.filename, "rb" if self._binary else "r") as fp:
+        suites = self._loader(fp) or []
+        return { suite["name"] : suite for suite in suites }, self._signature(fp)
     except FileNotFoundError:
       # no statefile yet
-      pass
+      return {}, None
+
+  def _signature(self, fp=None):
+    """
+    Identify the version of the state file, which is replaced on every write.
+    """
+    try:
+      info = os.fstat(fp.fileno()) if fp else os.stat(self.filename)
+    except FileNotFoundError:
+      return None
+    return (info.st_ino, info.st_size, info.st_mtime_ns)
+
+  def _load(self):
+    logger.info("💾 loading")
+    self.data = {}
+    self._chunks.clear()
+    self._raw, self._version = self._read()
+
+  def _load_suite(self, name):
+    suite = super()._load_suite(name)
+    self._seen[name] = run_keys(suite)
+    return suite
+
+  def add(self, suite):
+    self._dropped.discard(suite.name)
+    self._chunks.pop(suite.name, None)
+    return super().add(suite)
+
+  def forget(self, name):
+    super().forget(name)
+    self._chunks.pop(name, None)
+
+  def drop(self, name):
+    self.forget(name)
+    self._dropped.add(name)
+    self.changed(name)
+    return self
+
+  def _chunk(self, name):
+    if not name in self._chunks:
+      suite = self._marshalled(name)
+      self._chunks[name] = self._encoder(suite) if self._encoder else suite
+    return self._chunks[name]
+
+  @contextlib.contextmanager
+  def _locked(self):
+    try:
+      import fcntl
+    except ModuleNotFoundError:
+      # no advisory locking on this platform, writes are still atomic
+      yield
+      return
+    with open(f"{self.filename}.lock", "a") as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def _merge(self):
+    """
+    Reconcile with the state file, if another process replaced it.
+    """
+    if self._signature() == self._version:
+      return
+    logger.info("💾 merging concurrent changes")
+    stored, _ = self._read()
+    for name, suite in stored.items():
+      if name in self.data:
+        if merge_runs(self.data[name], suite, self._seen.get(name, {})):
+          self._chunks.pop(name, None)
+          if self.retention:
+            self.data[name].trim(self.retention)
+      elif not name in self._dropped:
+        self._raw[name] = suite
+        self._chunks.pop(name, None)
+    # unloaded suites that were dropped by another process
+    for name in [ name for name, suite in self._raw.items() if suite is not None ]:
+      if not name in stored:
+        del self._raw[name]
+        self._chunks.pop(name, None)
+
+  def persist(self, name):
+    self.persist_all([ name ])
 
-  def persist(self, suite):
+  def persist_all(self, names):
     logger.info(f"💾 saving")
-    with open(self.filename, "w") as fp:
-      self._saver([ suite.as_dict() for suite in self.data.values() ], fp, indent=2)
+    for name in names:
+      self._chunks.pop(name, None)
+    temp = f"{self.filename}.{os.getpid()}.tmp"
+    with self._locked():
+      self._merge()
+      try:
+        with open(temp, "wb" if self._binary else "w") as fp:
+          self._saver((self._chunk(name) for name in self._names()), fp)
+        os.replace(temp, self.filename)
+      finally:
+        if os.path.exists(temp):
+          os.remove(temp)
+      self._version = self._signature()
+    self._seen = { name : run_keys(suite) for name, suite in self.data.items() }
+
+def run_key(run):
+  return (run["start"], run["end"]) if isinstance(run, dict) else (run.start, run.end)
+
+def run_keys(suite):
+  """
+  Provide the keys of the runs of all steps of a suite.
+  """
+  return {
+    (test.uid, index) : { run_key(run) for run in step.runs }
+    for test in suite.tests for index, step in enumerate(test.steps)
+  }
+
+def merge_runs(suite, stored, seen):
+  """
+  Add the runs of a stored suite that are neither known to the suite, nor were
+  seen before, i.e. that were added by another process, to the matching steps.
+  Runs that were removed from the suite, e.g. by a reset, are not restored.
+  Returns True if runs were added.
+  """
+  tests  = { test["uid"] : test for test in stored.get("tests", []) if "uid" in test }
+  merged = False
+  for test in suite.tests:
+    other = tests.get(test.uid)
+    if not other:
+      continue
+    for index, (step, d) in enumerate(zip(test.steps, other.get("steps", []))):
+      if d.get("name") != step.name:
+        continue
+      known   = seen.get((test.uid, index), set()) | { run_key(run) for run in step.runs }
+      others  = d.get("runs", [])
+      others  = others if isinstance(others, list) else [ others ]
+      foreign = [ Run.from_dict(run) for run in others if not run_key(run) in known ]
+      if foreign:
+        step.runs = sorted(step.runs + foreign, key=lambda run: run.start or "")
+        merged    = True
+  return merged
+
+def run_counts(suite):
+  """
+  Provide the number of runs and the generation of all steps of a suite.
+  """
+  return {
+    (test.uid, index) : (len(step.runs), step.generation)
+    for test in suite.tests for index, step in enumerate(test.steps)
+  }
+
+def appended(before, current):
+  """
+  Determine, given the run_counts of a suite before and now, whether runs were
+  only appended: its structure didn't change, and no runs were removed, by a
+  reset or a trim, even if as many were added again since.
+  """
+  return bool(before) and list(before.keys()) == list(current.keys()) and \
+         all(current[key][0] >= count and current[key][1] == generation
+             for key, (count, generation) in before.items())
+
+def yaml_loader():
+  import yaml
+  # use libyaml, if it is available
+  Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+  return lambda fp: yaml.load(fp, Loader=Loader)
+
+def yaml_encoder():
+  import yaml
+  Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+  # every suite is dumped as a list with one item, together forming one list
+  return lambda suite: yaml.dump(
+    [ suite ], Dumper=Dumper, indent=2, default_flow_style=False
+  )
+
+def concatenate(chunks, fp):
+  for chunk in chunks:
+    fp.write(chunk)
 
 class YamlState(FileState):
   def __init__(self, filename):
-    super().__init__(filename, loader=yaml.safe_load, saver=yaml.dump)
+    super().__init__(
+      filename, loader=yaml_loader(), saver=concatenate, encoder=yaml_encoder()
+    )
+
+def json_encode(suite):
+  return json.dumps(suite, default=str)
+
+def json_save(chunks, fp):
+  # one suite per line
+  fp.write("[")
+  for index, chunk in enumerate(chunks):
+    fp.write(",\n" if index else "\n")
+    fp.write(chunk)
+  fp.write("\n]\n")
 
 class JsonState(FileState):
   def __init__(self, filename):
-    super().__init__(filename, loader=json.load, saver=json.dump)
+    super().__init__(filename, loader=json.load, saver=json_save, encoder=json_encode)
 
-class MongoState(State):
-  def __init__(self, collection):
+def msgpack_load(fp):
+  import msgpack
+  return list(msgpack.Unpacker(fp, raw=False))
+
+def msgpack_encoder():
+  import msgpack
+  # a stream of suites
+  return msgpack.Packer(default=str).pack
+
+class MsgpackState(FileState):
+  """
+  File-based state in the compact, binary MessagePack format (msgpack://).
+  Requires the `msgpack` module.
+  """
+  def __init__(self, filename):
+    super().__init__(
+      filename, loader=msgpack_load, saver=concatenate, binary=True,
+      encoder=msgpack_encoder()
+    )
+
+class JournalState(MarshalledState):
+  """
+  File-based state that appends changes to a journal, one JSON record per line,
+  instead of rewriting all suites on every change. Loading replays the journal.
+  
+  Records are either a snapshot of an entire suite, a run of a step or the
+  removal of a suite:
+  
+    {"suite": {"name": "mock", "tests": [...]}}
+    {"suite": "mock", "test": "mock", "step": 2, "run": {"start": ...}}
+    {"drop": "mock"}
+  
+  New runs are appended as run records. Other changes, e.g. adding a test or
+  resetting a suite, result in a new snapshot of the suite. Once the journal
+  has grown by `compact_after` records, it is compacted into snapshots only.
+  """
+  def __init__(self, filename, compact_after=1000):
     super().__init__()
-    self.collection = collection
+    self.filename      = filename
+    self.compact_after = compact_after
+    self._records      = 0
+    self._journaled    = {} # name -> run_counts of the suite
     self._load()
 
   def _load(self):
-    for suite in self.collection.find({}):
-      self.add(Suite.from_dict(suite))
+    logger.info("💾 replaying journal")
+    suites   = {}
+    replayed = set() # names of suites with replayed runs
+    try:
+      with open(self.filename) as fp:
+        for line in fp:
+          if line.strip():
+            record = json.loads(line)
+            self._replay(suites, record)
+            if "run" in record:
+              replayed.add(record["suite"])
+            self._records += 1
+    except FileNotFoundError:
+      # no journal yet
+      pass
+    # the statuses in the snapshots, used for summaries, predate replayed runs
+    for name in replayed & suites.keys():
+      for test in suites[name]["tests"]:
+        test["status"] = reduce_states([
+          step.get("status", "unknown") for step in test.get("steps", [])
+        ])
+      suites[name]["status"] = reduce_states([
+        test["status"] for test in suites[name]["tests"]
+      ])
+    self._raw.update(suites)
+
+  def _load_suite(self, name):
+    suite = super()._load_suite(name)
+    self._journaled[name] = run_counts(suite)
+    return suite
+
+  def _replay(self, suites, record):
+    if "drop" in record:
+      suites.pop(record["drop"], None)
+    elif "run" in record:
+      test = next(
+        test for test in suites[record["suite"]]["tests"]
+        if test["uid"] == record["test"]
+      )
+      step = test["steps"][record["step"]]
+      runs = step.get("runs", [])
+      if not isinstance(runs, list):
+        runs = [ runs ]
+      step["runs"]   = runs + [ record["run"] ]
+      step["status"] = step_status(
+        record["run"].get("status"), step.get("ignore"), step.get("noretry")
+      )
+    else:
+      suites[record["suite"]["name"]] = record["suite"]
+
+  def _append(self, records):
+    with open(self.filename, "a") as fp:
+      for record in records:
+        fp.write(json.dumps(record, default=str) + "\n")
+    self._records += len(records)
+    if self._records >= self.compact_after:
+      self.compact()
+
+  def persist(self, name):
+    suite   = self.data[name]
+    before  = self._journaled.get(name)
+    current = run_counts(suite)
+    if appended(before, current):
+      records = [
+        { "suite": name, "test": test.uid, "step": index, "run": run.as_dict() }
+        for test in suite.tests
+        for index, step in enumerate(test.steps)
+        for run in step.runs[before[(test.uid, index)][0]:]
+      ]
+    else:
+      records = [ { "suite" : suite.as_dict() } ]
+    logger.info(f"💾 journaling {len(records)} record(s)")
+    self._journaled[name] = current
+    if records:
+      self._append(records)
+
+  def drop(self, name):
+    self.forget(name)
+    self._journaled.pop(name, None)
+    self._append([ { "drop" : name } ])
+    return self
+
+  def compact(self):
+    """
+    Rewrite the journal as a snapshot of all suites.
+    """
+    logger.info("💾 compacting journal")
+    compacted = f"{self.filename}.compacting"
+    with open(compacted, "w") as fp:
+      for name in self._names():
+        fp.write(json.dumps({ "suite" : self._marshalled(name) }, default=str) + "\n")
+    os.replace(compacted, self.filename)
+    self._records = len(self)
+
+class SqliteState(State):
+  """
+  State stored in a SQLite database, with normalised tables for suites, tests,
+  steps and runs. Suites are only loaded when they are accessed, and the
+  summaries, results and list of suites are queried directly.
+  
+  Persisting a suite rewrites its (small) test and step rows and only inserts
+  the runs that were added since the previous persist.
+  """
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS suites (
+      name     TEXT PRIMARY KEY,
+      position INTEGER,
+      status   TEXT
+    );
+    CREATE TABLE IF NOT EXISTS tests (
+      suite      TEXT,
+      uid        TEXT,
+      position   INTEGER,
+      status     TEXT,
+      definition TEXT,
+      PRIMARY KEY (suite, uid)
+    );
+    CREATE TABLE IF NOT EXISTS steps (
+      suite      TEXT,
+      test       TEXT,
+      position   INTEGER,
+      name       TEXT,
+      status     TEXT,
+      rolled_up  INTEGER,
+      definition TEXT,
+      PRIMARY KEY (suite, test, position)
+    );
+    CREATE TABLE IF NOT EXISTS runs (
+      id       INTEGER PRIMARY KEY AUTOINCREMENT,
+      suite    TEXT,
+      test     TEXT,
+      step     INTEGER,
+      start    TEXT,
+      end      TEXT,
+      status   TEXT,
+      skipped  INTEGER,
+      output   TEXT,
+      info     TEXT,
+      memory   TEXT,
+      timings  TEXT
+    );
+    CREATE INDEX IF NOT EXISTS suites_status ON suites (status);
+    CREATE INDEX IF NOT EXISTS tests_status  ON tests  (suite, status);
+    CREATE INDEX IF NOT EXISTS steps_status  ON steps  (suite, status);
+    CREATE INDEX IF NOT EXISTS runs_step     ON runs   (suite, test, step);
+    CREATE INDEX IF NOT EXISTS runs_status   ON runs   (status);
+    CREATE INDEX IF NOT EXISTS runs_start    ON runs   (start);
+  """
+
+  def __init__(self, filename):
+    super().__init__()
+    import sqlite3
+    self.filename = filename
+    self._lock    = threading.RLock()
+    self.db       = sqlite3.connect(filename, check_same_thread=False)
+    self._counts  = {} # name -> run_counts of the suite, when loaded or persisted
+    with self._lock, self.db:
+      self.db.executescript(self.SCHEMA)
+      columns = [ column[1] for column in self.db.execute("PRAGMA table_info(runs)") ]
+      # databases created before runs kept a memory and timings
+      for column in [ "memory", "timings" ]:
+        if not column in columns:
+          self.db.execute(f"ALTER TABLE runs ADD COLUMN {column} TEXT")
+
+  def _names(self):
+    with self._lock:
+      names = [ name for name, in self.db.execute(
+        "SELECT name FROM suites ORDER BY position"
+      ) ]
+    return names + [ name for name in self.data if not name in names ]
+
+  def _load_suite(self, name):
+    logger.info(f"💾 loading {name}")
+    with self._lock:
+      if not self.db.execute("SELECT 1 FROM suites WHERE name=?", (name,)).fetchone():
+        raise KeyError(name)
+      tests = {}
+      for uid, definition in self.db.execute(
+        "SELECT uid, definition FROM tests WHERE suite=? ORDER BY position", (name,)
+      ):
+        tests[uid] = dict(json.loads(definition), steps=[])
+      for test, definition in self.db.execute(
+        "SELECT test, definition FROM steps WHERE suite=? ORDER BY position", (name,)
+      ):
+        tests[test]["steps"].append(dict(json.loads(definition), runs=[]))
+      for test, step, start, end, status, skipped, output, info, memory, timings in self.db.execute(
+        """SELECT test, step, start, end, status, skipped, output, info, memory, timings
+           FROM runs WHERE suite=? ORDER BY id""", (name,)
+      ):
+        tests[test]["steps"][step]["runs"].append({
+          "start"  : start,
+          "end"    : end,
+          "status" : status,
+          "skipped": bool(skipped),
+          "output" : json.loads(output),
+          "info"   : info,
+          "memory" : json.loads(memory) if memory else None,
+          "timings": json.loads(timings) if timings else None
+        })
+    suite = Suite.from_dict({ "name" : name, "tests" : list(tests.values()) })
+    self._counts[name] = run_counts(suite)
+    return suite
 
   def persist(self, name):
     suite = self.data[name]
-    self.collection.replace_one({ "name": name }, suite.as_dict(), True)
+    logger.info(f"💾 saving {name}")
+    with self._lock, self.db:
+      self.db.execute(
+        """INSERT INTO suites (name, position, status)
+           VALUES (?, (SELECT COUNT(*) FROM suites), ?)
+           ON CONFLICT(name) DO UPDATE SET status=excluded.status""",
+        (name, suite.status)
+      )
+      persisted = {
+        (test, step) : count for test, step, count in self.db.execute(
+          "SELECT test, step, COUNT(*) FROM runs WHERE suite=? GROUP BY test, step",
+          (name,)
+        )
+      }
+      rolled_up = {
+        (test, step) : count for test, step, count in self.db.execute(
+          "SELECT test, position, rolled_up FROM steps WHERE suite=?", (name,)
+        )
+      }
+      generations = {
+        key : generation for key, (_, generation) in self._counts.get(name, {}).items()
+      }
+      self.db.execute("DELETE FROM tests WHERE suite=?", (name,))
+      self.db.execute("DELETE FROM steps WHERE suite=?", (name,))
+      for position, test in enumerate(suite.tests):
+        definition = test.as_dict()
+        for key in [ "steps", "status" ]:
+          definition.pop(key, None)
+        self.db.execute(
+          "INSERT INTO tests VALUES (?, ?, ?, ?, ?)",
+          (name, test.uid, position, test.status, json.dumps(definition, default=str))
+        )
+        for index, step in enumerate(test.steps):
+          definition = step.as_dict()
+          for key in [ "runs", "status" ]:
+            definition.pop(key, None)
+          self.db.execute(
+            "INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, test.uid, index, step.name, step.status, step.rollup.runs,
+             json.dumps(definition, default=str))
+          )
+          count = persisted.pop((test.uid, index), 0)
+          if count > len(step.runs) or \
+             rolled_up.get((test.uid, index), 0) != step.rollup.runs or \
+             generations.get((test.uid, index), 0) != step.generation:
+            # runs were removed, e.g. by a reset or a trim
+            self.db.execute(
+              "DELETE FROM runs WHERE suite=? AND test=? AND step=?",
+              (name, test.uid, index)
+            )
+            count = 0
+          self.db.executemany(
+            "INSERT INTO runs (suite, test, step, start, end, status, skipped, output, info, memory, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+              (name, test.uid, index, run.start, run.end, run.status,
+               bool(run.skipped), json.dumps(run.output, default=str), run.info,
+               json.dumps(run.memory, default=str) if run.memory else None,
+               json.dumps(run.timings) if run.timings else None)
+              for run in step.runs[count:]
+            ]
+          )
+      # remove runs of tests and steps that are no longer part of the suite
+      for test, step in persisted:
+        self.db.execute(
+          "DELETE FROM runs WHERE suite=? AND test=? AND step=?", (name, test, step)
+        )
+    self._counts[name] = run_counts(suite)
+
+  def drop(self, name):
+    self.data.pop(name, None)
+    self._counts.pop(name, None)
+    with self._lock, self.db:
+      for table, column in [ ("suites", "name"), ("tests", "suite"),
+                             ("steps", "suite"), ("runs", "suite") ]:
+        self.db.execute(f"DELETE FROM {table} WHERE {column}=?", (name,))
+    return self
+
+  @property
+  def summary(self):
+    summary = { name : suite.status for name, suite in self.data.items() }
+    with self._lock:
+      summary.update(self.db.execute("SELECT name, status FROM suites"))
+    return { name : summary[name] for name in self._names() }
+
+  @property
+  def summaries(self):
+    summaries = { name : {} for name in self._names() }
+    with self._lock:
+      for suite, test, status, count in self.db.execute(
+        """SELECT tests.suite, tests.uid, steps.status, COUNT(steps.status)
+           FROM tests LEFT JOIN steps
+             ON steps.suite = tests.suite AND steps.test = tests.uid
+           GROUP BY tests.suite, tests.uid, steps.status
+           ORDER BY tests.suite, tests.position"""
+      ):
+        summaries[suite].setdefault(test, {})[status] = count
+    return {
+      suite : self.data[suite].summary if suite in self.data else {
+        test : summarize(counts) for test, counts in tests.items()
+      } for suite, tests in summaries.items()
+    }
+
+  def results(self, name):
+    if name in self.data:
+      return self.data[name].results
+    results = {}
+    with self._lock:
+      for test, step, start, end, output, info, status, skipped in self.db.execute(
+        """SELECT steps.test, steps.name,
+                  runs.start, runs.end, runs.output, runs.info, runs.status,
+                  runs.skipped
+           FROM tests JOIN steps
+             ON steps.suite = tests.suite AND steps.test = tests.uid
+           LEFT JOIN runs ON runs.id = (
+             SELECT MAX(id) FROM runs
+             WHERE runs.suite = steps.suite AND runs.test = steps.test
+               AND runs.step = steps.position
+           )
+           WHERE tests.suite=?
+           ORDER BY tests.position, steps.position""", (name,)
+      ):
+        results.setdefault(test, {})[step] = None if start is None else {
+          "start"   : start,
+          "end"     : end,
+          "output"  : json.loads(output),
+          "info"    : info,
+          "status"  : status,
+          "skipped" : bool(skipped)
+        }
+    return results
+
+class MongoState(State):
+  """
+  State stored in a MongoDB collection, one document per suite.
+  
+  Once a suite has been stored, persisting it only sends what changed: new runs
+  are pushed onto the runs of their step and statuses are set, all in a single
+  update. Other changes, e.g. adding a test, resetting or trimming runs, replace
+  the entire document.
+  """
+  def __init__(self, collection):
+    super().__init__()
+    self.collection = collection
+    self._persisted = {} # name -> run_counts of the suite
+
+  def _names(self):
+    names = [ suite["name"] for suite in self.collection.find({}, { "name" : 1 }) ]
+    return names + [ name for name in self.data if not name in names ]
+
+  def _load_suite(self, name):
+    suite = self.collection.find_one({ "name" : name })
+    if not suite:
+      raise KeyError(name)
+    suite = Suite.from_dict(suite)
+    self._persisted[name] = run_counts(suite)
+    return suite
+
+  def _stored(self, name):
+    return self.collection.find_one({ "name" : name }, {
+      "status" : 1, "tests.uid" : 1, "tests.steps.status" : 1
+    })
+
+  def persist(self, name):
+    suite   = self.data[name]
+    before  = self._persisted.get(name)
+    current = run_counts(suite)
+    if appended(before, current):
+      self.collection.update_one({ "name" : name }, self._delta(suite, before))
+    else:
+      self.collection.replace_one({ "name": name }, suite.as_dict(), True)
+    self._persisted[name] = current
+
+  def _delta(self, suite, before):
+    statuses = { "status" : suite.status }
+    pushes   = {}
+    for t, test in enumerate(suite.tests):
+      statuses[f"tests.{t}.status"] = test.status
+      for s, step in enumerate(test.steps):
+        statuses[f"tests.{t}.steps.{s}.status"] = step.status
+        new = step.runs[before[(test.uid, s)][0]:]
+        if new:
+          pushes[f"tests.{t}.steps.{s}.runs"] = {
+            "$each" : [ run.as_dict() for run in new ]
+          }
+    update = { "$set" : statuses }
+    if pushes:
+      update["$push"] = pushes
+    return update
 
   @property
   def suites(self):
-    return list(self.collection.distinct("suite"))
+    return list(self.collection.distinct("name"))
 
-  def drop(self, suite):
-    del self[suite]
-    self.collection.delete_many({"name" : suite })
+  def drop(self, name):
+    self.data.pop(name, None)
+    self._persisted.pop(name, None)
+    self.collection.delete_many({"name" : name })
     return self
@@ -0,0 +1,40 @@
+"""
+HTTP testers, drop-in replacements for `requests.get`, `requests.post`, ...
+that reuse a session (and its connections) per server for all steps of a suite,
+see `testman.pool`. Like with the requests functions, cookies aren't kept
+between requests.
+"""
+
+import urllib.parse
+
+from testman.pool import connection
+
+# requests is imported when it is needed, it is only required for these testers
+
+def session():
+  import requests
+  return requests.Session()
+
+def request(method, url, **kwargs):
+  parts = urllib.parse.urlsplit(url)
+  key   = ("http", parts.scheme, parts.netloc, repr(kwargs.get("auth")))
+  with connection(key, open=session, close=lambda s: s.close()) as s:
+    try:
+      return s.request(method, url, **kwargs)
+    finally:
+      s.cookies.clear()
+
+def get(url, **kwargs):
+  return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+  return request("POST", url, **kwargs)
+
+def put(url, **kwargs):
+  return request("PUT", url, **kwargs)
+
+def patch(url, **kwargs):
+  return request("PATCH", url, **kwargs)
+
+def delete(url, **kwargs):
+  return request("DELETE", url, **kwargs)
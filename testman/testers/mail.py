@@ -3,6 +3,26 @@ import poplib
 import email
 import email.policy
 
+from testman import memory
+from testman.pool import connection
+from testman.util import mapped
+
+def smtp(server, username, password):
+  conn = smtplib.SMTP(server)
+  conn.ehlo()
+  conn.starttls()
+  conn.login(username, password)
+  return conn
+
+def smtp_alive(conn):
+  return conn.noop()[0] == 250
+
+def smtp_close(conn):
+  try:
+    conn.quit()
+  except smtplib.SMTPException:
+    conn.close()
+
 def send(server=None, username=None, password=None, recipient=None, subject=None, body=None):
   msg = "\r\n".join([
     f"From: {recipient}",
@@ -11,25 +31,68 @@ def send(server=None, username=None, password=None, recipient=None, subject=None
     "",
     body
   ])
-  server = smtplib.SMTP(server)
-  server.ehlo()
-  server.starttls()
-  server.login(username, password)
-  server.sendmail(username, [recipient], msg)
-  server.close()
-
-def pop(server=None, username=None, password=None):
+  # the connection is reused by all steps of a suite, see testman.pool
+  key = ("smtp", server, username, password)
+  with connection(key, open=lambda: smtp(server, username, password),
+                       close=smtp_close, check=smtp_alive) as conn:
+    conn.sendmail(username, [recipient], msg)
+
+# POP3 sessions aren't pooled: a session only sees the messages that were in
+# the mailbox when it was opened (RFC 1939), so a reused session would never
+# see newly delivered messages.
+def pop(server=None, username=None, password=None, incremental=False,
+        headers=False, match=None):
+  """
+  Fetches the messages in a mailbox as dicts with their headers and Body.
+  
+  - incremental: only fetch messages that weren't seen by previous runs of the
+                 step, identified by their unique id (UIDL)
+  - headers    : only fetch the headers of messages (TOP), not their Body
+  - match      : a predicate, or a Python expression using `mail`, that only
+                 gets the headers, selecting the messages to return
+  """
+  if isinstance(match, str):
+    match = predicate(match)
   conn = poplib.POP3_SSL(server)
   conn.user(username)
   conn.pass_(password)
-  messages = [ conn.retr(i) for i in range(1, len(conn.list()[1]) + 1) ]
-  conn.quit()
-  result = []
-  for msg in messages:
-    m = email.message_from_bytes(b"\n".join(msg[1]), policy=email.policy.default)
-    r = {}
-    for k, v in dict(m.items()).items():
-      r[k] = str(v)
-    r["Body"] = m.get_content()
-    result.append(r)
+  try:
+    if incremental:
+      seen   = set(memory().get("seen", []))
+      unique = dict(
+        line.decode().split(" ", 1) for line in conn.uidl()[1]
+      )
+      numbers = [ int(number) for number, uid in unique.items() if not uid in seen ]
+    else:
+      numbers = range(1, len(conn.list()[1]) + 1)
+    result = []
+    for number in numbers:
+      if headers or match:
+        mail = fields(parse(conn.top(number, 0)[1]))
+        if match and not match(mapped(mail)):
+          continue
+        if headers:
+          result.append(mail)
+          continue
+      result.append(fields(parse(conn.retr(number)[1]), body=True))
+    if incremental:
+      # only remember what is still in the mailbox
+      memory()["seen"] = list(unique.values())
+  finally:
+    conn.quit()
   return result
+
+def parse(lines):
+  return email.message_from_bytes(b"\n".join(lines), policy=email.policy.default)
+
+def fields(msg, body=False):
+  r = {}
+  for k, v in dict(msg.items()).items():
+    r[k] = str(v)
+  if body:
+    r["Body"] = msg.get_content()
+  return r
+
+def predicate(source):
+  code = compile(source, "<match>", "eval")
+  return lambda mail: eval(code, { "mail" : mail })
@@ -1,17 +1,106 @@
 import logging
 logger = logging.getLogger()
 
-import os
+import time
 import importlib
-import re
 import datetime
+import threading
+from collections import OrderedDict
 
-import yaml
 import json
 
-from dotmap import DotMap
-
-def get_function(func):
+# yaml and dotmap are imported when they are needed, to keep startup fast
+
+registry = {} # explicitly registered functions
+resolved = OrderedDict() # resolved names, or the Unresolvable failure to
+                         # resolve them, least recently used first
+
+# at most this many resolved names are kept
+RESOLVED_MAX = 4096
+_resolving   = threading.Lock()
+
+# failures to resolve a name are retried after this many seconds, e.g. in a
+# long-running process, after a tester module was fixed or became available
+UNRESOLVABLE_TTL = 60
+
+class Unresolvable():
+  def __init__(self, error):
+    self.error   = type(error)
+    self.args    = error.args
+    self.expires = time.monotonic() + UNRESOLVABLE_TTL
+
+  @property
+  def expired(self):
+    return time.monotonic() >= self.expires
+
+  def throw(self):
+    raise self.error(*self.args)
+
+def register(func=None, name=None):
+  """
+  Registers a function, under its fully qualified name or the given name, so
+  that it can be performed without resolving it. Can be used as a decorator:
+  
+    @register
+    def hello(name):
+      ...
+    
+    @register(name="greet")
+    def hello(name):
+      ...
+  """
+  if func is None:
+    return lambda func: register(func, name=name)
+  name = name or f"{func.__module__}.{func.__name__}"
+  registry[name] = func
+  resolved.pop(name, None)
+  return func
+
+def unregister(name):
+  registry.pop(name, None)
+  resolved.pop(name, None)
+
+def get_function(func, cache_failures=True):
+  """
+  Resolves a (dotted) name to a function, caching the outcome, so that names
+  are only imported or evaluated once. Failures to resolve a name are cached
+  for UNRESOLVABLE_TTL seconds, unless `cache_failures` is False, e.g. for
+  substituted values, which rarely are names, and are rarely tried twice.
+  """
+  result = lookup_function(func, cache_failures=cache_failures)
+  if isinstance(result, Unresolvable):
+    result.throw()
+  return result
+
+def lookup_function(func, cache_failures=True):
+  """
+  Resolves a name like get_function, but returns an Unresolvable instead of
+  raising its failure.
+  """
+  result = registry.get(func)
+  if result is not None:
+    return result
+  with _resolving:
+    result = resolved.get(func)
+    if result is not None:
+      resolved.move_to_end(func)
+  if result is None or isinstance(result, Unresolvable) and result.expired:
+    if result is not None:
+      # pick up modules that were added since the failure
+      importlib.invalidate_caches()
+    try:
+      result = resolve_function(func)
+    except Exception as e:
+      result = Unresolvable(e)
+    if cache_failures or not isinstance(result, Unresolvable):
+      with _resolving:
+        resolved[func] = result
+        resolved.move_to_end(func)
+        while len(resolved) > RESOLVED_MAX:
+          resolved.popitem(last=False)
+  return result
+
+def resolve_function(func):
   if "." in func:
     mod_name, func_name = func.rsplit(".", 1)
     mod = importlib.import_module(mod_name)
@@ -20,60 +109,19 @@ def get_function(func):
     return eval(func)
 
 def expand(value, vars=None):
-  # dict?
-  if isinstance(value, dict):
-    return { k : expand(v, vars) for k, v in value.items() }
-
-  # list?
-  if isinstance(value, list):
-    return [ expand(v, vars) for v in value ]
-
-  # load from file (prefix ~)
-  if value[0] == "~":
-    with open(value[1:]) as fp:
-      value = fp.read()
-
-  # expand
-  if not vars:
-    vars = {}
-  else:
-    vars = dict(vars) # copy to avoid leaking back
-  # logger.info(json.dumps(vars, indent=2, default=str))
-  vars.update(os.environ) # add environment variables
-  # turn all values into mapped values
-  vars = { k: mapped(v) for k,v in vars.items() }
-  r = re.compile(r"{([^}]+)}")
-  for stmt in r.findall(value):
-    replacement = eval(stmt, {}, vars)
-    if replacement:
-      if value == "{" + stmt + "}":
-        value = replacement
-      else:
-        value = value.replace("{"+stmt+"}", str(replacement))
-    else:
-      raise ValueError(f"unknown variable '{var}'")
-
-  # try it as a function
-  try:
-    func, process = parse_command(value)
-    value = postprocess(func(), process)
-  except:
-    pass
-
-  # try eval
-  try:
-    value = eval(value, vars)
-  except:
-    pass
-
-  return value
-
-def parse_command(cmd):
+  """
+  Expands a (nested) value, given variables. Strings are compiled once and
+  cached, see `testman.expression`.
+  """
+  from testman.expression import compiled, evaluate
+  return evaluate(compiled(value), vars)
+
+def parse_command(cmd, cache_failures=True):
   # parse string into func and filters
   if isinstance(cmd, str):
     try:
       filters = [ filter.strip() for filter in cmd.split("|") ]
-      func    = get_function(filters.pop(0))
+      func    = get_function(filters.pop(0), cache_failures=cache_failures)
       return func, filters
     except ModuleNotFoundError as e:
       raise ValueError(f"unknown module for {cmd}") from e
@@ -83,9 +131,8 @@ def parse_command(cmd):
     return cmd, []
   raise ValueError(f"not a valid command string")
 
-def format_command(func, filters=""):
-  if filters:
-    filters = "|" + "|".join(filters)
+def format_command(func, filters=None):
+  filters = "|" + "|".join(filters) if filters else ""
   return f"{func.__module__}.{func.__name__}{filters}"
 
 def postprocess(output, processors):
@@ -119,6 +166,7 @@ def prune(d):
   return { k:v for k,v in d.items() if v or v == False }
 
 def load_ml(filename):
+  import yaml
   _, ext = filename.rsplit(".", 1)
   loader = {
     "yaml" : yaml.safe_load,
@@ -130,6 +178,7 @@ def load_ml(filename):
 
 def mapped(value):
   if isinstance(value, dict):
+    from dotmap import DotMap
     return DotMap(value)
   if isinstance(value, list):
     return [ mapped(v) for v in value ]
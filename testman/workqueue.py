@@ -0,0 +1,281 @@
+"""
+Distributed execution of suites using a local work queue.
+
+A coordinator splits a suite into work items, one per test, on a queue that is
+kept in a SQLite database, so that no external services are required. Worker
+processes, on the same machine or sharing the database file, claim items,
+execute their tests and put the executed tests back on the queue, from where
+the coordinator merges their runs into the suite, and thus into the state.
+
+  % testman worker --queue work.db --idle 60 &
+  % testman worker --queue work.db --idle 60 &
+  % testman state yaml://state.yaml select mock dispatch --queue work.db
+
+A claimed item is leased to a worker for `lease` seconds, which the worker
+renews while it is executing the test. If a worker dies, its lease expires and
+the item is claimed by another worker, up to `attempts` times.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import contextlib
+
+from testman import Test, execute_test
+
+class Item():
+  def __init__(self, id, suite, test, attempts):
+    self.id       = id
+    self.suite    = suite
+    self.test     = test     # marshalled test
+    self.attempts = attempts
+
+class WorkQueue():
+  """
+  keeps work items in a SQLite database, which is shared by all processes that
+  use the queue.
+  """
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS items (
+      id           INTEGER PRIMARY KEY AUTOINCREMENT,
+      suite        TEXT,
+      test         TEXT,
+      status       TEXT,
+      worker       TEXT,
+      expires      REAL,
+      attempts     INTEGER DEFAULT 0,
+      max_attempts INTEGER,
+      result       TEXT,
+      error        TEXT
+    );
+    CREATE INDEX IF NOT EXISTS items_status ON items (status, id);
+  """
+
+  def __init__(self, filename, attempts=3, clock=time.time):
+    self.filename = filename
+    self.attempts = attempts
+    self.clock    = clock
+    self._lock    = threading.RLock()
+    # transactions are handled explicitly
+    self.db = sqlite3.connect(
+      filename, timeout=60, isolation_level=None, check_same_thread=False
+    )
+    with self._lock:
+      self.db.executescript(self.SCHEMA)
+
+  @contextlib.contextmanager
+  def _transaction(self):
+    # claiming an item requires an exclusive lock on the database, which is
+    # taken immediately to avoid deadlocks between workers
+    with self._lock:
+      self.db.execute("BEGIN IMMEDIATE")
+      try:
+        yield self.db
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+      self.db.execute("COMMIT")
+
+  def put(self, suite, test):
+    """
+    Put a marshalled test of a suite on the queue. Returns the id of the item.
+    """
+    with self._transaction() as db:
+      return db.execute(
+        "INSERT INTO items (suite, test, status, max_attempts) VALUES (?, ?, 'queued', ?)",
+        (suite, json.dumps(test, default=str), self.attempts)
+      ).lastrowid
+
+  def claim(self, worker, lease=300):
+    """
+    Claim a queued item, or an item of which the lease expired, for `lease`
+    seconds. Returns the item, or None if none is available.
+    """
+    while True:
+      now = self.clock()
+      with self._transaction() as db:
+        row = db.execute(
+          """SELECT id, suite, test, status, worker, attempts, max_attempts
+               FROM items
+              WHERE status='queued' OR (status='leased' AND expires < ?)
+              ORDER BY id LIMIT 1""", (now,)
+        ).fetchone()
+        if not row:
+          return None
+        id, suite, test, status, previous, attempts, max_attempts = row
+        if status == "leased":
+          logger.warning(f"⌛ lease of {previous} on item {id} expired")
+          if attempts >= max_attempts:
+            db.execute(
+              "UPDATE items SET status='failed', error=? WHERE id=?",
+              (f"lease expired {attempts} time(s)", id)
+            )
+            continue
+        db.execute(
+          """UPDATE items SET status='leased', worker=?, expires=?, attempts=?
+              WHERE id=?""", (worker, now + lease, attempts + 1, id)
+        )
+      logger.info(f"📥 {worker} claimed item {id}")
+      return Item(id, suite, json.loads(test), attempts + 1)
+
+  def renew(self, item, worker, lease=300):
+    """
+    Extend the lease on an item. Returns False if it is no longer leased to the
+    worker.
+    """
+    with self._transaction() as db:
+      return db.execute(
+        """UPDATE items SET expires=?
+            WHERE id=? AND worker=? AND status='leased'""",
+        (self.clock() + lease, item.id, worker)
+      ).rowcount == 1
+
+  @contextlib.contextmanager
+  def renewing(self, item, worker, lease=300):
+    """
+    Keep renewing the lease on an item, from a background thread, for the
+    duration of the block.
+    """
+    done = threading.Event()
+    def renew():
+      while not done.wait(lease / 3):
+        if not self.renew(item, worker, lease=lease):
+          logger.warning(f"⌛ {worker} lost its lease on item {item.id}")
+          return
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+      yield item
+    finally:
+      done.set()
+      renewer.join()
+
+  def complete(self, item, worker, result):
+    """
+    Put the executed, marshalled test back on the queue. Returns False if the
+    item is no longer leased to the worker, e.g. because it was cancelled.
+    """
+    with self._transaction() as db:
+      return db.execute(
+        """UPDATE items SET status='done', result=?, expires=NULL
+            WHERE id=? AND worker=? AND status='leased'""",
+        (json.dumps(result, default=str), item.id, worker)
+      ).rowcount == 1
+
+  def fail(self, item, worker, error):
+    """
+    Give up on an item: it is queued again, unless it was attempted too often.
+    """
+    with self._transaction() as db:
+      db.execute(
+        """UPDATE items
+              SET status=CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                  error=?, expires=NULL
+            WHERE id=? AND worker=? AND status='leased'""",
+        (str(error), item.id, worker)
+      )
+
+  def take(self, ids):
+    """
+    Remove the finished items with the given ids from the queue. Returns a list
+    of (id, status, marshalled test or None, error) tuples.
+    """
+    if not ids:
+      return []
+    marks = ",".join("?" * len(ids))
+    with self._transaction() as db:
+      rows = db.execute(
+        f"""SELECT id, status, result, error FROM items
+             WHERE id IN ({marks}) AND status IN ('done', 'failed')""", ids
+      ).fetchall()
+      if rows:
+        db.execute(
+          f"DELETE FROM items WHERE id IN ({','.join('?' * len(rows))})",
+          [ row[0] for row in rows ]
+        )
+    return [
+      (id, status, json.loads(result) if result else None, error)
+      for id, status, result, error in rows
+    ]
+
+  def cancel(self, ids):
+    """
+    Remove items from the queue, whatever their status.
+    """
+    if ids:
+      with self._transaction() as db:
+        db.execute(f"DELETE FROM items WHERE id IN ({','.join('?' * len(ids))})", ids)
+
+  def __len__(self):
+    with self._lock:
+      return self.db.execute(
+        "SELECT COUNT(*) FROM items WHERE status IN ('queued', 'leased')"
+      ).fetchone()[0]
+
+  def close(self):
+    self.db.close()
+
+def dispatch(suite, queue, poll=1.0, timeout=None, clock=time.monotonic, sleep=time.sleep):
+  """
+  Execute a suite using workers: put its tests on the queue, wait until they
+  have been executed and merge their runs into the tests of the suite. Tests
+  that weren't executed before the optional `timeout` are taken off the queue,
+  and a TimeoutError is raised. Whatever the reason to stop waiting, e.g. an
+  interrupt, unfinished tests are taken off the queue.
+  """
+  pending = {}
+  try:
+    for test in suite.tests:
+      pending[queue.put(suite.name, test.as_dict())] = test
+    logger.info(f"📤 dispatched {len(pending)} test(s) of {suite.name}")
+    start = clock()
+    while pending:
+      for id, status, result, error in queue.take(list(pending)):
+        test = pending.pop(id)
+        if status == "done":
+          test.merge(Test.from_dict(result))
+        else:
+          logger.error(f"🚨 '{test.description}' wasn't executed: {error}")
+      if not pending:
+        break
+      if timeout is not None and clock() - start >= timeout:
+        raise TimeoutError(f"{len(pending)} test(s) of {suite.name} weren't executed")
+      sleep(poll)
+  finally:
+    queue.cancel(list(pending))
+    suite._notify("execute", suite)
+  return suite
+
+def work(queue, worker=None, lease=300, poll=1.0, idle=None, sleep=time.sleep):
+  """
+  Keep claiming and executing items, until none were available for `idle`
+  seconds, or forever. Returns the number of executed items.
+  """
+  worker   = worker or f"{socket.gethostname()}:{os.getpid()}"
+  executed = 0
+  waited   = 0
+  logger.info(f"👷 {worker} waiting for work")
+  while True:
+    item = queue.claim(worker, lease=lease)
+    if not item:
+      if idle is not None and waited >= idle:
+        return executed
+      sleep(poll)
+      waited += poll
+      continue
+    waited = 0
+    try:
+      with queue.renewing(item, worker, lease=lease):
+        result = execute_test(item.test)
+    except Exception as e:
+      logger.error(f"🚨 {worker} failed to execute item {item.id}: {e}")
+      queue.fail(item, worker, e)
+      continue
+    if queue.complete(item, worker, result):
+      executed += 1
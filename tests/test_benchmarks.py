@@ -0,0 +1,21 @@
+"""
+  Benchmark tests
+
+  All benchmarks can be performed, here with tiny workloads.
+"""
+
+import benchmarks
+
+def test_all_benchmarks_can_be_measured():
+  results = [
+    benchmarks.measure(name, scale=0.01, repeat=1) for name in benchmarks.benchmarks
+  ]
+  assert all(result.operations > 0 and result.throughput > 0 for result in results)
+
+def test_regressions_are_detected(tmp_path):
+  result = benchmarks.Result("steps", "steps", 100, 1.0, 0)
+  benchmarks.save([ result ], tmp_path / "baseline.json")
+  baseline = benchmarks.load(tmp_path / "baseline.json")
+  assert benchmarks.regressions([ result ], baseline) == []
+  slower = benchmarks.Result("steps", "steps", 100, 2.0, 0)
+  assert benchmarks.regressions([ slower ], baseline) == [ "steps" ]
@@ -0,0 +1,58 @@
+"""
+  CLI tests
+
+  Commands are chained using Fire, so options of a command must not consume
+  the next command of the chain.
+"""
+
+import json
+
+from fire import Fire
+
+import testman.cli
+
+def chain(tmp_path, *commands):
+  script = tmp_path / "script.json"
+  script.write_text(json.dumps({
+    "uid"   : "script",
+    "name"  : "script",
+    "steps" : [ {
+      "name"    : "step",
+      "perform" : "testman.testers.mock.test",
+      "with"    : { "hello" : "world" }
+    } ]
+  }))
+  cli = testman.cli.TestManCLI()
+  Fire(cli, command=[ "load", str(script), *commands ], name="testman")
+  return cli
+
+def executed(cli):
+  return len(cli.suite.tests[0].steps[0].runs)
+
+def test_retain_options_do_not_consume_commands(tmp_path):
+  cli = chain(tmp_path, "retain", "--last", "2", "execute", "summary")
+  assert executed(cli) == 1
+  assert cli.suites.retention.last == 2
+
+def test_capture_options_do_not_consume_commands(tmp_path):
+  cli = chain(tmp_path, "capture", "--limit", "100", "execute", "summary")
+  assert executed(cli) == 1
+  assert cli.suites.capture.limit == 100
+
+def test_profile_does_not_consume_commands(tmp_path, monkeypatch):
+  import testman
+  monkeypatch.chdir(tmp_path)
+  try:
+    cli = chain(tmp_path, "profile", "execute", "summary")
+  finally:
+    testman.profile(None)
+  assert executed(cli) == 1
+  assert len(list((tmp_path / "profiles").iterdir())) == 1
+
+def test_defer_does_not_consume_commands(tmp_path):
+  cli = chain(tmp_path, "defer", "execute", "summary")
+  assert executed(cli) == 1
+  assert cli.suites._interval is None
+  cli = chain(tmp_path, "defer", "--interval", "5", "execute")
+  assert executed(cli) == 1
+  assert cli.suites._interval == 5
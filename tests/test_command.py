@@ -61,3 +61,110 @@ def test_parse_command_with_multiple_filter():
   func, filters = parse_command("testman.util.utcnow | isoformat | len")
   result = postprocess(func(), filters)
   assert isinstance(result, int)
+
+# Resolving
+
+def test_resolved_functions_are_cached(monkeypatch):
+  import importlib
+  from testman.util import get_function, resolved
+  resolved.clear()
+  imports = []
+  original = importlib.import_module
+  def import_module(name):
+    imports.append(name)
+    return original(name)
+  monkeypatch.setattr(importlib, "import_module", import_module)
+  assert get_function("testman.util.utcnow") is get_function("testman.util.utcnow")
+  assert imports == [ "testman.util" ]
+
+def test_failures_to_resolve_are_cached(monkeypatch):
+  import importlib
+  from testman.util import get_function, resolved
+  resolved.clear()
+  imports = []
+  original = importlib.import_module
+  def import_module(name):
+    imports.append(name)
+    return original(name)
+  monkeypatch.setattr(importlib, "import_module", import_module)
+  for _ in range(3):
+    try:
+      parse_command("not.a.module")
+      assert False, "expected a ValueError"
+    except ValueError:
+      pass
+  assert imports == [ "not.a" ]
+
+def test_failures_to_resolve_are_retried(monkeypatch, tmp_path):
+  import sys
+  import testman.util
+  from testman.util import get_function, resolved
+  resolved.clear()
+  monkeypatch.setattr(testman.util, "UNRESOLVABLE_TTL", 0)
+  monkeypatch.syspath_prepend(str(tmp_path))
+  monkeypatch.delitem(sys.modules, "late_tester", raising=False)
+  try:
+    get_function("late_tester.hello")
+    assert False, "expected a ModuleNotFoundError"
+  except ModuleNotFoundError:
+    pass
+  # the module becomes available, e.g. in a long-running watch
+  (tmp_path / "late_tester.py").write_text("def hello():\n  return 'hello'\n")
+  try:
+    assert get_function("late_tester.hello")() == "hello"
+  finally:
+    sys.modules.pop("late_tester", None)
+    resolved.clear()
+
+def test_failures_to_resolve_substituted_values_are_not_cached():
+  from testman.util import resolved
+  from testman.expression import compiled, evaluate
+  resolved.clear()
+  template = compiled("id.{ID}")
+  for index in range(100):
+    assert evaluate(template, { "ID" : f"value{index}" }) == f"id.value{index}"
+  assert not resolved
+
+def test_resolved_functions_are_bounded(monkeypatch):
+  import testman.util
+  from testman.util import get_function, resolved
+  resolved.clear()
+  monkeypatch.setattr(testman.util, "RESOLVED_MAX", 2)
+  get_function("testman.util.utcnow")
+  get_function("testman.util.expand")
+  get_function("testman.util.utcnow")
+  get_function("testman.util.mapped")
+  assert list(resolved) == [ "testman.util.utcnow", "testman.util.mapped" ]
+  resolved.clear()
+
+def test_static_commands_are_retried(monkeypatch, tmp_path):
+  import sys
+  import testman.util
+  from testman.util import expand, resolved
+  resolved.clear()
+  monkeypatch.setattr(testman.util, "UNRESOLVABLE_TTL", 0)
+  monkeypatch.syspath_prepend(str(tmp_path))
+  monkeypatch.delitem(sys.modules, "late_values", raising=False)
+  assert expand("late_values.value") == "late_values.value"
+  (tmp_path / "late_values.py").write_text("def value():\n  return 42\n")
+  try:
+    assert expand("late_values.value") == 42
+  finally:
+    sys.modules.pop("late_values", None)
+    resolved.clear()
+
+def test_registered_functions():
+  from testman.util import register, unregister
+  @register(name="greet")
+  def hello():
+    return "hello"
+  try:
+    func, filters = parse_command("greet | upper")
+    assert postprocess(func(), filters) == "HELLO"
+  finally:
+    unregister("greet")
+  try:
+    parse_command("greet")
+    assert False, "expected an error"
+  except NameError:
+    pass
@@ -0,0 +1,108 @@
+"""
+  Context tests
+
+  A test's execution context provides variables, constants and the outputs of
+  previous steps, evaluating and mapping them only when they are used.
+"""
+
+import testman
+import testman.testers.mock
+from testman import Step, Constant
+
+def chain(size):
+  steps = [
+    Step.from_dict({
+      "name"   : f"step {index}",
+      "perform": "testman.testers.mock.test",
+      "with"   : { "value" : f"STEP[{index-1}].value" } if index else { "value" : "start" },
+      "assert" : "result.value == 'start'"
+    }) for index in range(size)
+  ]
+  return testman.Test("chain", steps)
+
+def test_outputs_are_mapped_once_per_step(monkeypatch):
+  calls = []
+  def counting_mapped(value):
+    calls.append(value)
+    return testman.util.mapped(value)
+  monkeypatch.setattr(testman, "mapped", counting_mapped)
+
+  for size in [ 50, 500 ]:
+    calls.clear()
+    test = chain(size)
+    test.execute()
+    assert test.status == "success"
+    # every step's output is mapped once for STEP and once as assertion result
+    assert len(calls) == 2 * size - 1
+
+tracked = []
+def track():
+  tracked.append(True)
+  return "value"
+
+def test_variables_are_only_evaluated_when_referenced():
+  tracked.clear()
+  variables = { "V" : "tests.test_context.track" }
+  test = testman.Test("vars", [ Step(name="step", func=lambda: True) ], variables=variables)
+  test.execute()
+  assert not tracked
+  test = testman.Test("vars", [
+    Step(name="step", func=testman.testers.mock.test, args={ "a": "V", "b" : "V" })
+  ], variables=variables)
+  test.execute()
+  assert tracked == [ True ]
+
+def test_constants_and_steps_in_scope():
+  step = Step(name="step", func=lambda: { "hello" : "world" })
+  test = testman.Test("scope", [ step ], constants={ "C" : Constant("1", 1) })
+  test.execute()
+  scope = test.vars
+  assert scope["C"] == 1
+  assert scope["STEP"][0].hello == "world"
+  assert scope["STEP"][0] is scope["STEP"][0]
+
+def test_step_dependencies_are_analysed():
+  test = testman.Test.from_dict({
+    "steps" : [
+      { "name" : "a", "perform" : "testman.testers.mock.test" },
+      { "name" : "b", "perform" : "testman.testers.mock.test",
+        "with" : { "value" : "{STEP[0].value}" } },
+      { "name" : "c", "perform" : "testman.testers.mock.test",
+        "assert" : "result == STEP[1]" },
+      { "name" : "d", "perform" : "testman.testers.mock.test",
+        "with" : { "value" : "STEP[-1]" } },
+    ]
+  })
+  assert test.dependencies == [ set(), {0}, {1}, {0, 1, 2} ]
+
+def nap(seconds):
+  import time
+  time.sleep(seconds)
+  return True
+
+def test_independent_steps_are_executed_concurrently():
+  import time
+  steps = [
+    Step.from_dict({ "name" : f"sleep {index}", "perform" : "tests.test_context.nap",
+                     "with" : { "seconds" : 0.1 } })
+    for index in range(5)
+  ]
+  test = testman.Test("wide", steps, parallel=True)
+  start = time.time()
+  test.execute()
+  assert time.time() - start < 0.3
+  assert test.status == "success"
+
+def test_failing_step_only_blocks_its_dependents():
+  test = testman.Test.from_dict({
+    "parallel" : True,
+    "steps" : [
+      { "name" : "fails", "perform" : "testman.testers.mock.test",
+        "with" : { "fail" : "oops" } },
+      { "name" : "depends", "perform" : "testman.testers.mock.test",
+        "with" : { "value" : "STEP[0]" } },
+      { "name" : "independent", "perform" : "testman.testers.mock.test" },
+    ]
+  })
+  test.execute()
+  assert test.overview == [ "pending", "unknown", "success" ]
@@ -0,0 +1,65 @@
+"""
+  Expression tests
+
+  Strings are compiled once into Expressions and evaluated against a lazily
+  built Namespace.
+"""
+
+from testman.expression import Expression, Namespace, compiled, evaluate
+
+def test_strings_are_compiled_once():
+  assert compiled("hello {WORLD}") is compiled("hello {WORLD}")
+
+def test_nested_values_are_compiled():
+  template = compiled({ "list" : [ "a", "{B}" ], "number" : 1 })
+  assert isinstance(template["list"][1], Expression)
+  assert template["number"] == 1
+  assert evaluate(template, { "B" : "b" }) == { "list" : [ "a", "b" ], "number" : 1 }
+
+def test_namespace_resolves_lazily_and_once():
+  requested = []
+  class Vars(dict):
+    def __getitem__(self, key):
+      requested.append(key)
+      return super().__getitem__(key)
+  namespace = Namespace(Vars({ "A" : { "x" : 1 }, "B" : 2 }))
+  assert evaluate(compiled("x={A.x}, again x={A.x}"), namespace) == "x=1, again x=1"
+  assert requested == [ "A" ]
+  assert namespace["A"] is namespace["A"]
+
+def test_nested_namespace_doesnt_remap():
+  outer = Namespace({ "A" : { "x" : 1 } })
+  inner = Namespace(outer, result=1)
+  assert inner["A"] is outer["A"]
+  assert eval("result + A.x", inner) == 2
+
+def test_syntax_errors_are_raised_on_evaluation():
+  template = compiled('{"a": 1}')
+  try:
+    evaluate(template)
+    assert False, "expected a SyntaxError"
+  except SyntaxError:
+    pass
+
+def test_non_string_values_are_kept():
+  assert evaluate(compiled([ 1, True, None ])) == [ 1, True, None ]
+
+def test_placeholders_are_bound_as_variables():
+  from testman.expression import bound
+  expression = bound('result == {EXPECTED}')
+  assert expression.source == 'result == (__placeholder_0__)'
+  assert expression.evaluate(Namespace({ "result" : [ 1 ], "EXPECTED" : [ 1 ] }))
+
+def test_placeholders_in_strings_are_concatenated():
+  from testman.expression import bound
+  expression = bound('result == "id-{ID}" and "{" == "{"')
+  assert expression.evaluate(Namespace({ "result" : "id-1", "ID" : 1 }))
+
+def test_placeholders_spanning_strings_cant_be_bound():
+  from testman.expression import bound
+  assert bound('"{A" + "}"') is None
+  assert bound('result == f"{A}"') is None
+
+def test_bound_expressions_are_cached():
+  from testman.expression import bound
+  assert bound("result == {X}") is bound("result == {X}")
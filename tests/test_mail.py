@@ -0,0 +1,99 @@
+"""
+  Mail tester tests
+
+  Polling a mailbox incrementally only fetches the messages that weren't seen
+  by previous runs of the step.
+"""
+
+import testman
+from testman import Step
+
+class Mailbox():
+  messages  = {}
+  retrieved = []
+  topped    = []
+
+  def __init__(self, server):
+    pass
+
+  def user(self, username): pass
+  def pass_(self, password): pass
+  def quit(self):            pass
+
+  def _lines(self, uid):
+    return Mailbox.messages[uid].encode().split(b"\n")
+
+  def _uid(self, number):
+    return list(Mailbox.messages)[number-1]
+
+  def list(self):
+    return (b"+OK", [ f"{n} 100".encode() for n in range(1, len(Mailbox.messages)+1) ], 0)
+
+  def uidl(self):
+    return (b"+OK", [
+      f"{n} {uid}".encode() for n, uid in enumerate(Mailbox.messages, 1)
+    ], 0)
+
+  def retr(self, number):
+    Mailbox.retrieved.append(self._uid(number))
+    return (b"+OK", self._lines(self._uid(number)), 0)
+
+  def top(self, number, lines):
+    Mailbox.topped.append(self._uid(number))
+    headers = self._lines(self._uid(number))
+    return (b"+OK", headers[:headers.index(b"")], 0)
+
+def deliver(uid, subject):
+  Mailbox.messages[uid] = f"From: me\nSubject: {subject}\n\nhello {uid}\n"
+
+def mailbox(monkeypatch):
+  import testman.testers.mail
+  monkeypatch.setattr(testman.testers.mail.poplib, "POP3_SSL", Mailbox)
+  Mailbox.messages.clear()
+  Mailbox.retrieved.clear()
+  Mailbox.topped.clear()
+
+def test_full_mailbox_is_fetched_by_default(monkeypatch):
+  mailbox(monkeypatch)
+  deliver("a", "first")
+  deliver("b", "second")
+  from testman.testers.mail import pop
+  assert [ mail["Subject"] for mail in pop() ] == [ "first", "second" ]
+  assert pop()[1]["Body"] == "hello b\n"
+
+def test_incremental_polling_only_fetches_new_messages(monkeypatch):
+  mailbox(monkeypatch)
+  deliver("a", "old")
+  step = Step.from_dict({
+    "name"    : "check delivery",
+    "perform" : "testman.testers.mail.pop",
+    "with"    : { "incremental" : True },
+    "assert"  : "any(mail.Subject == 'new' for mail in result)"
+  })
+  step.execute()
+  assert step.status == "pending"
+  assert step.memory == { "seen" : [ "a" ] }
+  # memory survives marshalling
+  step = Step.from_dict(step.as_dict())
+  deliver("b", "new")
+  step.execute()
+  assert step.status == "success"
+  assert Mailbox.retrieved == [ "a", "b" ]
+  assert step.memory == { "seen" : [ "a", "b" ] }
+
+def test_only_matching_messages_are_retrieved(monkeypatch):
+  mailbox(monkeypatch)
+  deliver("a", "spam")
+  deliver("b", "A message from TestMan (123)")
+  from testman.testers.mail import pop
+  result = pop(match="'TestMan' in mail.Subject")
+  assert [ mail["Body"] for mail in result ] == [ "hello b\n" ]
+  assert Mailbox.topped == [ "a", "b" ]
+  assert Mailbox.retrieved == [ "b" ]
+
+def test_headers_only(monkeypatch):
+  mailbox(monkeypatch)
+  deliver("a", "first")
+  from testman.testers.mail import pop
+  assert pop(headers=True) == [ { "From" : "me", "Subject" : "first" } ]
+  assert not Mailbox.retrieved
@@ -0,0 +1,69 @@
+"""
+  Metrics tests
+
+  Metrics are updated as runs complete and rendered in the OpenMetrics format.
+"""
+
+import urllib.request
+
+import testman
+from testman.metrics import Metrics
+
+def a_suite():
+  return testman.Suite("suite", [
+    testman.Test.from_dict({
+      "name"  : "test",
+      "steps" : [
+        { "name" : "ok", "perform" : "testman.testers.mock.test" },
+        { "name" : "fails", "perform" : "testman.testers.mock.test",
+          "with" : { "fail" : "oops" } },
+        { "name" : "never", "perform" : "testman.testers.mock.test" }
+      ]
+    })
+  ])
+
+def samples(metrics):
+  return dict(
+    line.rsplit(" ", 1) for line in metrics.render().splitlines()
+    if not line.startswith("#")
+  )
+
+def test_metrics_are_updated_as_runs_complete():
+  suite   = a_suite()
+  metrics = Metrics().track(suite)
+  found   = samples(metrics)
+  assert found['testman_steps{suite="suite",status="unknown"}'] == "3"
+  suite.execute()
+  suite.execute()
+  found = samples(metrics)
+  assert found['testman_runs_total{suite="suite",status="success"}'] == "1"
+  assert found['testman_runs_total{suite="suite",status="failed"}'] == "2"
+  assert found['testman_steps{suite="suite",status="success"}'] == "1"
+  assert found['testman_steps{suite="suite",status="pending"}'] == "1"
+  assert found['testman_steps{suite="suite",status="unknown"}'] == "1"
+  assert found['testman_step_latency_seconds_count{suite="suite"}'] == "3"
+  assert found['testman_step_latency_seconds_bucket{suite="suite",le="+Inf"}'] == "3"
+  assert metrics.render().endswith("# EOF\n")
+
+def test_steps_are_recounted_after_a_reset():
+  suite   = a_suite()
+  metrics = Metrics().track(suite)
+  suite.execute()
+  suite.reset()
+  assert samples(metrics)['testman_steps{suite="suite",status="unknown"}'] == "3"
+
+def test_metrics_are_written_and_served(tmp_path):
+  suite   = a_suite()
+  metrics = Metrics().track(suite)
+  suite.execute()
+  metrics.write(tmp_path / "testman.prom")
+  assert (tmp_path / "testman.prom").read_text() == metrics.render()
+  server = metrics.serve(0)
+  try:
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    with urllib.request.urlopen(url) as response:
+      assert response.headers["Content-Type"].startswith("application/openmetrics-text")
+      assert response.read().decode() == metrics.render()
+  finally:
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,125 @@
+"""
+  Pool tests
+
+  While a suite is executed, testers reuse their connections for all of its
+  steps and tests, and they are closed at the end.
+"""
+
+import threading
+
+import pytest
+
+import testman
+from testman.pool import Pool, pooled, connection, current
+
+class Connection():
+  opened = []
+  def __init__(self, *args):
+    self.closed = False
+    Connection.opened.append(self)
+
+  def close(self):
+    self.closed = True
+
+def use(key="server"):
+  with connection(key, open=Connection, close=Connection.close) as conn:
+    return conn
+
+def test_connections_are_reused_within_a_pool():
+  Connection.opened.clear()
+  with pooled():
+    assert use() is use()
+    assert use("other") is not use()
+  assert len(Connection.opened) == 2
+  assert all(conn.closed for conn in Connection.opened)
+  assert current() is None
+
+def test_connections_are_closed_without_a_pool():
+  Connection.opened.clear()
+  assert use() is not use()
+  assert all(conn.closed for conn in Connection.opened)
+
+def test_failing_connections_are_discarded():
+  Connection.opened.clear()
+  with pooled():
+    with pytest.raises(RuntimeError):
+      with connection("server", open=Connection, close=Connection.close):
+        raise RuntimeError("broken")
+    assert Connection.opened[0].closed
+    assert use() is not Connection.opened[0]
+
+def test_stale_connections_are_replaced():
+  with pooled():
+    first = use()
+    with connection("server", open=Connection, close=Connection.close,
+                    check=lambda conn: not conn is first) as second:
+      assert second is not first
+    assert first.closed
+
+def test_connections_are_used_exclusively():
+  pool  = Pool()
+  first = pool.acquire("server", Connection)
+  assert pool.acquire("server", Connection) is not first
+  pool.release("server", first)
+  assert pool.acquire("server", Connection) is first
+
+class SMTP(Connection):
+  def ehlo(self):              pass
+  def starttls(self):          pass
+  def login(self, user, pwd):  pass
+  def noop(self):              return (250, b"OK")
+  def quit(self):              self.close()
+  def sendmail(self, sender, recipients, msg):
+    pass
+
+def test_mail_is_sent_over_one_connection_per_suite(monkeypatch):
+  import testman.testers.mail
+  monkeypatch.setattr(testman.testers.mail.smtplib, "SMTP", SMTP)
+  Connection.opened.clear()
+  step = {
+    "name"    : "send",
+    "perform" : "testman.testers.mail.send",
+    "with"    : { "server" : "localhost", "username" : "me", "password" : "pwd",
+                  "recipient" : "me", "subject" : "hi", "body" : "hello" }
+  }
+  suite = testman.Suite("mail", [
+    testman.Test.from_dict({ "name" : f"test {index}", "steps" : [ step, step ] })
+    for index in range(3)
+  ])
+  suite.execute(workers=3)
+  assert suite.status == "success"
+  assert 1 <= len(Connection.opened) <= 3
+  assert all(conn.closed for conn in Connection.opened)
+
+def test_http_sessions_are_reused():
+  pytest.importorskip("requests")
+  import http.server
+  clients = set()
+  class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    def do_GET(self):
+      clients.add(self.client_address)
+      self.send_response(200)
+      self.send_header("Content-Length", "2")
+      self.end_headers()
+      self.wfile.write(b"ok")
+    def log_message(self, *args):
+      pass
+  server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  try:
+    url  = f"http://127.0.0.1:{server.server_address[1]}/"
+    test = testman.Test.from_dict({
+      "name"  : "http",
+      "steps" : [
+        { "name" : f"get {index}", "perform" : "testman.testers.http.get | text",
+          "with" : { "url" : url }, "assert" : "result == 'ok'" }
+        for index in range(5)
+      ]
+    })
+    test.execute()
+    assert test.status == "success"
+    assert len(clients) == 1
+  finally:
+    server.shutdown()
+    server.server_close()
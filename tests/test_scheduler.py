@@ -0,0 +1,133 @@
+"""
+  Scheduler tests
+
+  The scheduler keeps executing tests with due steps, retrying pending steps
+  with an exponential backoff, until they succeed or their deadline passes.
+"""
+
+import datetime
+
+import testman
+from testman import Retention
+from testman.state import State
+from testman.scheduler import Scheduler
+
+attempts = []
+def flaky(succeed_after):
+  attempts.append(True)
+  assert len(attempts) > succeed_after, "not yet"
+  return True
+
+def suite(succeed_after):
+  return testman.Suite("flaky", [ testman.Test.from_dict({
+    "name" : "flaky",
+    "steps" : [
+      { "name" : "flaky", "perform" : "tests.test_scheduler.flaky",
+        "with" : { "succeed_after" : succeed_after } },
+      { "name" : "after", "perform" : "testman.testers.mock.test" }
+    ]
+  }) ])
+
+class Clock():
+  def __init__(self):
+    self.start  = testman.util.utcnow()
+    self.offset = 0
+    self.sleeps = []
+
+  def now(self):
+    return self.start + datetime.timedelta(seconds=self.offset)
+
+  def time(self):
+    return self.start.timestamp() + self.offset
+
+  def sleep(self, seconds):
+    self.sleeps.append(round(seconds))
+    self.offset += seconds
+
+def schedule(monkeypatch, succeed_after, **kwargs):
+  attempts.clear()
+  state = State()
+  state.add(suite(succeed_after))
+  clock = Clock()
+  monkeypatch.setattr(testman, "utcnow", clock.now)
+  scheduler = Scheduler(state, interval=10, clock=clock.now, sleep=clock.sleep,
+                        **kwargs)
+  return state, clock, scheduler
+
+def test_pending_steps_are_retried_with_backoff(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 3)
+  scheduler.run()
+  assert state["flaky"].status == "success"
+  assert len(attempts) == 4
+  assert clock.sleeps == [ 10, 20, 40 ]
+
+def test_backoff_is_capped(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 4, max_delay=15)
+  scheduler.run()
+  assert clock.sleeps == [ 10, 15, 15, 15 ]
+
+def test_pending_steps_are_given_up_after_deadline(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 100, deadline=60)
+  scheduler.run()
+  step = state["flaky"].tests[0].steps[0]
+  assert step.status == "failed"
+  assert step.noretry
+  assert state["flaky"].tests[0].steps[1].status == "unknown"
+
+def test_nothing_is_due_when_done(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 0)
+  assert scheduler.tick() is None
+  assert scheduler.tick() is None
+  assert len(attempts) == 1
+
+def test_deferred_changes_are_flushed_before_sleeping(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 1)
+  persisted = []
+  state.persist = persisted.append
+  state.defer()
+  def sleep(seconds):
+    assert not state.dirty
+    clock.sleep(seconds)
+  scheduler.sleep = sleep
+  scheduler.run()
+  assert persisted == [ "flaky", "flaky" ]
+
+def test_steps_after_an_ignored_failure_are_done(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 100)
+  state["flaky"].tests[0].steps[0].ignore = True
+  scheduler.run()
+  test = state["flaky"].tests[0]
+  assert test.steps[0].status == "ignored"
+  assert len(test.steps[0].runs) == 1
+  assert test.steps[1].status == "unknown"
+  assert scheduler.tick() is None
+  assert len(attempts) == 1
+
+def test_given_up_steps_are_persisted(monkeypatch, tmp_path):
+  from tests.test_state import delta_states
+  for create in delta_states(tmp_path):
+    attempts.clear()
+    state = create()
+    state.add(suite(100))
+    clock = Clock()
+    monkeypatch.setattr(testman, "utcnow", clock.now)
+    Scheduler(state, interval=10, deadline=60,
+              clock=clock.now, sleep=clock.sleep).run()
+    step = create()["flaky"].tests[0].steps[0]
+    assert step.status == "failed"
+    assert step.noretry
+
+def test_trimmed_failures_still_count(monkeypatch):
+  state, clock, scheduler = schedule(monkeypatch, 4)
+  state.retention = Retention(last=1)
+  scheduler.run()
+  assert clock.sleeps == [ 10, 20, 40, 80 ]
+
+  state, clock, scheduler = schedule(monkeypatch, 100, deadline=60)
+  state.retention = Retention(last=1)
+  scheduler.run()
+  step = state["flaky"].tests[0].steps[0]
+  assert step.status == "failed"
+  assert len(step.runs) == 1
+  assert step.rollup.failing == 2
+  assert len(attempts) == 3
@@ -0,0 +1,42 @@
+"""
+  Startup tests
+
+  The CLI is typically invoked often, e.g. from cron, so its cold start is
+  guarded: heavy dependencies are only imported when they are used, and the
+  import time of the CLI stays within a budget (in µs, TESTMAN_STARTUP_BUDGET).
+"""
+
+import os
+import sys
+import subprocess
+
+BUDGET = int(os.environ.get("TESTMAN_STARTUP_BUDGET", 500000))
+
+LAZY = [ "pymongo", "yaml", "dotmap", "dotenv", "sqlite3", "asyncio",
+         "concurrent.futures" ]
+
+def import_times(*args):
+  process = subprocess.run(
+    [ sys.executable, "-X", "importtime", *args ],
+    capture_output=True, text=True, check=True
+  )
+  times = {}
+  for line in process.stderr.splitlines():
+    if line.startswith("import time:") and not "cumulative" in line:
+      _, cumulative, module = line[len("import time:"):].split("|")
+      times[module.strip()] = int(cumulative)
+  return times
+
+def test_cli_import_is_lazy():
+  times = import_times("-c", "import testman.cli")
+  for module in LAZY:
+    assert not module in times, f"{module} is imported at startup"
+
+def test_cli_import_budget():
+  times = import_times("-c", "import testman.cli")
+  assert times["testman.cli"] < BUDGET
+
+def test_version_command_is_lazy():
+  times = import_times("-m", "testman", "version")
+  for module in [ "pymongo", "yaml", "dotenv", "sqlite3" ]:
+    assert not module in times, f"{module} is imported for version"
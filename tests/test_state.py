@@ -0,0 +1,407 @@
+"""
+  State tests
+"""
+
+import json
+
+from testman       import Suite, Step
+from testman.state import JournalState, SqliteState
+
+import testman
+
+def a_suite(name="suite", tests=1):
+  return Suite(name, [
+    testman.Test("test", [
+      Step.from_dict({
+        "name"   : "step",
+        "perform": "testman.testers.mock.test",
+        "with"   : { "hello" : "world" },
+        "always" : True
+      })
+    ], uid=f"test {index}" if index else "test")
+    for index in range(tests)
+  ])
+
+def records(filename):
+  with open(filename) as fp:
+    return [ json.loads(line) for line in fp ]
+
+def test_journal_appends_runs(tmp_path):
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename)
+  state.add(a_suite())
+  state["suite"].execute()
+  state["suite"].execute()
+  state["suite"].execute()
+  journal = records(filename)
+  assert len(journal) == 3
+  assert len(journal[0]["suite"]["tests"][0]["steps"][0]["runs"]) == 1
+  assert journal[1]["run"]["output"] == { "hello" : "world" }
+  assert journal[2]["step"] == 0
+
+def test_journal_replay(tmp_path):
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename)
+  state.add(a_suite())
+  state["suite"].execute()
+  state["suite"].execute()
+  replayed = JournalState(filename)
+  assert replayed["suite"].as_dict() == state["suite"].as_dict()
+  assert len(replayed["suite"].tests[0].steps[0].runs) == 2
+
+def test_journal_summaries_include_replayed_runs(tmp_path):
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename)
+  state.add(a_suite())
+  state.changed("suite") # a snapshot without runs
+  state["suite"].execute()
+  assert "run" in records(filename)[-1]
+  replayed = JournalState(filename)
+  assert replayed.summary == { "suite" : "success" }
+  assert replayed.summaries["suite"]["test"]["success"] == 1
+  assert not replayed.data
+
+def test_journal_reset_and_drop(tmp_path):
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename)
+  state.add(a_suite("one"))
+  state.add(a_suite("two"))
+  state["one"].execute()
+  state["one"].reset()
+  assert "tests" in records(filename)[-1]["suite"]
+  state.drop("two")
+  replayed = JournalState(filename)
+  assert replayed.list == [ "one" ]
+  assert replayed["one"].tests[0].steps[0].runs == []
+
+def test_journal_compaction(tmp_path):
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename, compact_after=5)
+  state.add(a_suite())
+  for _ in range(5):
+    state["suite"].execute()
+  assert len(records(filename)) == 1
+  replayed = JournalState(filename)
+  assert len(replayed["suite"].tests[0].steps[0].runs) == 5
+
+def test_sqlite_state_round_trip(tmp_path):
+  filename = str(tmp_path / "state.db")
+  state = SqliteState(filename)
+  state.add(a_suite())
+  state["suite"].execute()
+  state["suite"].execute()
+  loaded = SqliteState(filename)
+  assert loaded.list == [ "suite" ]
+  assert loaded.summary == { "suite" : "success" }
+  assert loaded.summaries == { "suite" : { "test" : {
+    "unknown": 0, "success": 1, "ignored": 0, "pending": 0, "failed": 0,
+    "summary": "all done"
+  }}}
+  assert loaded.results("suite") == state["suite"].results
+  assert not loaded.data # nothing was materialised so far
+  assert loaded["suite"].as_dict() == state["suite"].as_dict()
+
+def test_sqlite_state_only_inserts_new_runs(tmp_path):
+  filename = str(tmp_path / "state.db")
+  state = SqliteState(filename)
+  state.add(a_suite())
+  state["suite"].execute()
+  first = state.db.execute("SELECT id FROM runs").fetchall()
+  state["suite"].execute()
+  assert state.db.execute("SELECT id FROM runs").fetchall()[:1] == first
+  state["suite"].reset()
+  assert state.db.execute("SELECT COUNT(*) FROM runs").fetchone() == (0,)
+  state.drop("suite")
+  assert SqliteState(filename).list == []
+
+def test_retention_is_applied_when_persisting(tmp_path):
+  from testman import Retention
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename)
+  state.retention = Retention(last=2)
+  state.add(a_suite())
+  for _ in range(4):
+    state["suite"].execute()
+  step = JournalState(filename)["suite"].tests[0].steps[0]
+  assert len(step.runs) == 2
+  assert step.rollup.counts == { "success" : 2 }
+
+def test_sqlite_state_with_retention(tmp_path):
+  from testman import Retention
+  filename = str(tmp_path / "state.db")
+  state = SqliteState(filename)
+  state.retention = Retention(last=2)
+  state.add(a_suite())
+  for _ in range(4):
+    state["suite"].execute()
+  step = SqliteState(filename)["suite"].tests[0].steps[0]
+  assert [ run.start for run in step.runs ] == \
+         [ run.start for run in state["suite"].tests[0].steps[0].runs ]
+  assert step.rollup.runs == 2
+
+def remember():
+  testman.memory()["calls"] = testman.memory().get("calls", 0) + 1
+  return True
+
+def test_step_memory_is_persisted(tmp_path):
+  filename = str(tmp_path / "state.db")
+  state = SqliteState(filename)
+  state.add(Suite("suite", [
+    testman.Test("test", [
+      Step.from_dict({ "name" : "step", "perform" : "tests.test_state.remember",
+                       "always" : True })
+    ], uid="test")
+  ]))
+  state["suite"].execute()
+  state["suite"].execute()
+  step = SqliteState(filename)["suite"].tests[0].steps[0]
+  assert step.memory == { "calls" : 2 }
+  assert step.runs[0].memory == { "calls" : 1 }
+
+def test_capture_is_applied_when_persisting(tmp_path):
+  from testman import Capture
+  filename = tmp_path / "state.journal"
+  state = JournalState(filename)
+  state.capture = Capture(limit=10, spill=str(tmp_path / "outputs"))
+  state.add(a_suite())
+  state["suite"].execute()
+  run = JournalState(filename)["suite"].tests[0].steps[0].last
+  assert "file" in run.output["$captured"]
+  assert run.value == { "hello" : "world" }
+
+def file_states():
+  from testman.state import YamlState, JsonState, MsgpackState
+  states = [ (YamlState, "yaml"), (JsonState, "json") ]
+  try:
+    import msgpack
+    states.append((MsgpackState, "msgpack"))
+  except ModuleNotFoundError:
+    pass
+  return states
+
+def test_file_states_load_suites_lazily(tmp_path):
+  for cls, extension in file_states():
+    filename = str(tmp_path / f"state.{extension}")
+    state = cls(filename)
+    state.add(a_suite("one"))
+    state.add(a_suite("two"))
+    state["one"].execute()
+    loaded = cls(filename)
+    assert loaded.list == [ "one", "two" ]
+    assert loaded.summary == { "one" : "success", "two" : "unknown" }
+    assert loaded.summaries["one"]["test"]["success"] == 1
+    assert not loaded.data
+    loaded["two"].execute()
+    assert list(loaded.data) == [ "two" ]
+    reloaded = cls(filename)
+    assert reloaded.list == [ "one", "two" ]
+    assert reloaded.summary == { "one" : "success", "two" : "success" }
+    reloaded.drop("one")
+    assert cls(filename).list == [ "two" ]
+
+def test_file_states_round_trip(tmp_path):
+  for cls, extension in file_states():
+    filename = str(tmp_path / f"state.{extension}")
+    state = cls(filename)
+    state.add(a_suite("one"))
+    state.add(a_suite("two"))
+    state["one"].execute()
+    assert cls(filename)["one"].as_dict() == state["one"].as_dict()
+    assert sorted(f.name for f in tmp_path.iterdir() if f.name.startswith(f"state.{extension}")) == \
+           [ f"state.{extension}", f"state.{extension}.lock" ]
+
+def test_file_states_are_replaced_atomically(tmp_path):
+  from testman.state import JsonState
+  filename = str(tmp_path / "state.json")
+  state = JsonState(filename)
+  state.add(a_suite("one"))
+  state.changed("one")
+  with open(filename) as fp:
+    before = fp.read()
+  def failing(suites, fp):
+    fp.write("[")
+    raise IOError("disk full")
+  state._saver = failing
+  try:
+    state.changed("one")
+    assert False, "expected an IOError"
+  except IOError:
+    pass
+  with open(filename) as fp:
+    assert fp.read() == before
+  assert sorted(f.name for f in tmp_path.iterdir()) == [ "state.json", "state.json.lock" ]
+
+def test_file_states_merge_concurrent_runs(tmp_path):
+  for cls, extension in file_states():
+    filename = str(tmp_path / f"state.{extension}")
+    state = cls(filename)
+    state.add(a_suite("one"))
+    state.add(a_suite("two"))
+    state.changed("one")
+    first, second = cls(filename), cls(filename)
+    first["one"].execute()
+    first["two"].execute()
+    second["one"].execute()
+    second["one"].execute()
+    merged = cls(filename)
+    assert len(merged["one"].tests[0].steps[0].runs) == 3
+    assert len(merged["two"].tests[0].steps[0].runs) == 1
+    starts = [ run.start for run in merged["one"].tests[0].steps[0].runs ]
+    assert starts == sorted(starts)
+
+def test_file_states_do_not_restore_removed_runs(tmp_path):
+  for cls, extension in file_states():
+    filename = str(tmp_path / f"state.{extension}")
+    state = cls(filename)
+    state.add(a_suite("one"))
+    state.add(a_suite("two"))
+    state["one"].execute()
+    first, second = cls(filename), cls(filename)
+    first["one"].reset()
+    second.drop("two")
+    merged = cls(filename)
+    assert merged.list == [ "one" ]
+    assert merged["one"].tests[0].steps[0].runs == []
+
+def execute_in_process(filename, times):
+  from testman.state import JsonState
+  state = JsonState(filename)
+  for _ in range(times):
+    state["one"].execute()
+
+def test_file_states_are_shared_by_processes(tmp_path):
+  import multiprocessing
+  from testman.state import JsonState
+  filename = str(tmp_path / "state.json")
+  state = JsonState(filename)
+  state.add(a_suite("one"))
+  state.changed("one")
+  processes = [
+    multiprocessing.Process(target=execute_in_process, args=(filename, 5))
+    for _ in range(4)
+  ]
+  for process in processes:
+    process.start()
+  for process in processes:
+    process.join()
+  assert len(JsonState(filename)["one"].tests[0].steps[0].runs) == 20
+
+def test_deferred_changes_are_persisted_when_flushed(tmp_path):
+  for cls, extension in file_states():
+    filename = str(tmp_path / f"state.{extension}")
+    state = cls(filename).defer()
+    state.add(a_suite("one"))
+    state.add(a_suite("two"))
+    state["one"].execute()
+    state["two"].execute()
+    state["one"].execute()
+    assert state.dirty == [ "one", "two" ]
+    assert cls(filename).list == []
+    state.flush()
+    assert not state.dirty
+    assert cls(filename).summary == { "one" : "success", "two" : "success" }
+    state.drop("two")
+    assert cls(filename).list == [ "one", "two" ]
+    state.flush()
+    assert cls(filename).list == [ "one" ]
+
+def test_deferred_changes_are_flushed_after_interval(tmp_path):
+  from testman.state import JsonState
+  filename = str(tmp_path / "state.json")
+  state = JsonState(filename).defer(interval=0)
+  state.add(a_suite("one"))
+  state["one"].execute()
+  assert not state.dirty
+  assert JsonState(filename).list == [ "one" ]
+
+def test_file_states_only_encode_changed_suites(tmp_path):
+  from testman.state import JsonState, json_encode
+  filename = str(tmp_path / "state.json")
+  state = JsonState(filename)
+  encoded = []
+  def encoder(suite):
+    encoded.append(suite["name"])
+    return json_encode(suite)
+  state._encoder = encoder
+  state.add(a_suite("one"))
+  state.add(a_suite("two"))
+  state["one"].execute()
+  state["two"].execute()
+  state["two"].execute()
+  assert encoded == [ "one", "two", "two", "two" ]
+  assert JsonState(filename)["one"].as_dict() == state["one"].as_dict()
+
+def delta_states(tmp_path):
+  from testman.state import MongoState
+  states = [
+    lambda: JournalState(str(tmp_path / "state.journal")),
+    lambda: SqliteState(str(tmp_path / "state.db"))
+  ]
+  try:
+    import mongomock
+    collection = mongomock.MongoClient().db.suites
+    states.append(lambda: MongoState(collection))
+  except ModuleNotFoundError:
+    pass
+  return states
+
+def test_reset_and_execute_are_persisted_when_coalesced(tmp_path):
+  for create in delta_states(tmp_path):
+    state = create()
+    state.add(a_suite("one"))
+    state["one"].execute()
+    old = state["one"].tests[0].steps[0].last.start
+    state = create().defer()
+    state["one"].reset()
+    state["one"].execute()
+    state.flush()
+    runs = create()["one"].tests[0].steps[0].runs
+    assert [ run.start for run in runs ] == [ state["one"].tests[0].steps[0].last.start ]
+    assert runs[0].start != old
+
+def test_mongo_state_loads_suites_lazily():
+  import pytest
+  mongomock = pytest.importorskip("mongomock")
+  from testman.state import MongoState
+  collection = mongomock.MongoClient().db.suites
+  state = MongoState(collection)
+  state.add(a_suite("one"))
+  state["one"].execute()
+  loaded = MongoState(collection)
+  assert loaded.list == [ "one" ]
+  assert loaded.summary == { "one" : "success" }
+  assert not loaded.data
+  assert loaded["one"].tests[0].steps[0].status == "success"
+  loaded.drop("one")
+  assert MongoState(collection).list == []
+
+def test_mongo_state_persists_deltas():
+  import pytest
+  mongomock = pytest.importorskip("mongomock")
+  from testman.state import MongoState
+  collection = mongomock.MongoClient().db.suites
+  state = MongoState(collection)
+  state.add(a_suite("one"))
+  state["one"].execute()
+
+  writes = []
+  original = collection.update_one
+  def update_one(query, update, **kwargs):
+    writes.append(update)
+    return original(query, update, **kwargs)
+  collection.update_one = update_one
+  state["one"].execute()
+  state["one"].execute()
+  assert len(writes) == 2
+  assert list(writes[0]["$push"].keys()) == [ "tests.0.steps.0.runs" ]
+
+  stored = collection.find_one({ "name" : "one" })
+  assert len(stored["tests"][0]["steps"][0]["runs"]) == 3
+  assert stored["tests"][0]["steps"][0]["status"] == "success"
+  assert MongoState(collection)["one"].as_dict() == state["one"].as_dict()
+
+  # a reset replaces the document
+  state["one"].reset()
+  assert len(writes) == 2
+  stored = collection.find_one({ "name" : "one" })
+  assert "runs" not in stored["tests"][0]["steps"][0]
@@ -26,3 +26,212 @@ def test_serialization_of_object_result():
   step.execute()
   assert isinstance(step.last.raw, str)
   assert len(step.as_dict()["runs"][0]["output"]) == 36
+
+def test_coroutine_tester_outside_event_loop():
+  async def f():
+    return True
+  step = Step(name="name", func=f, asserts=[ Assertion("result == True")] )
+  step.execute()
+  assert step.last.status == "success"
+
+def test_async_execution_of_coroutine_and_synchronous_testers():
+  import asyncio
+  async def f():
+    await asyncio.sleep(0)
+    return 1
+  def g():
+    return 2
+  steps = [
+    Step(name="async", func=f, asserts=[ Assertion("result == 1")] ),
+    Step(name="sync",  func=g, asserts=[ Assertion("result == 2")] )
+  ]
+  for step in steps:
+    asyncio.run(step.execute_async())
+    assert step.last.status == "success"
+
+def test_testers_returning_awaitables_are_awaited():
+  import asyncio
+  async def f():
+    await asyncio.sleep(0)
+    return 1
+  def decorated():
+    return f()
+  step = Step(name="decorated", func=decorated, asserts=[ Assertion("result == 1") ])
+  step.execute()
+  assert step.last.status == "success"
+  asyncio.run(step.execute_async())
+  assert step.last.status == "success"
+
+def run_of(status, start, duration=1, skipped=False):
+  import datetime
+  from testman import Run
+  run = Run()
+  run.status  = status
+  run.skipped = skipped
+  begin = datetime.datetime(2022, 1, 1) + datetime.timedelta(minutes=start)
+  run.start   = begin.isoformat()
+  run.end     = (begin + datetime.timedelta(seconds=duration)).isoformat()
+  return run
+
+def test_retention_keeps_last_runs_and_failures():
+  from testman import Retention
+  runs = [ run_of("failed", 0), run_of("success", 1), run_of("success", 2),
+           run_of("success", 3) ]
+  kept, trimmed = Retention(last=2).apply(runs)
+  assert kept == runs[2:] and trimmed == runs[:2]
+  kept, trimmed = Retention(last=1, failures=True).apply(runs)
+  assert kept == [ runs[0], runs[3] ]
+
+def test_retention_keeps_recent_runs():
+  import datetime
+  from testman import Retention
+  runs = [ run_of("success", minute) for minute in range(10) ]
+  now  = datetime.datetime(2022, 1, 1, 0, 10)
+  kept, _ = Retention(newer=150).apply(runs, now=now)
+  assert kept == runs[8:]
+
+def test_trimmed_runs_are_rolled_up():
+  from testman import Retention
+  step = Step(name="name", func=lambda: True)
+  step.runs = [ run_of("failed", 0, 2), run_of("success", 1, 4),
+                run_of("success", 2, 0, skipped=True), run_of("success", 3, 3) ]
+  step.trim(Retention(last=1))
+  assert len(step.runs) == 1
+  rollup = step.as_dict()["rollup"]
+  assert rollup["counts"] == { "failed" : 1, "success" : 2, "skipped" : 1 }
+  assert rollup["latency"]["min"] == 2 and rollup["latency"]["max"] == 4
+  assert rollup["latency"]["avg"] == 3
+  history = Step.from_dict(dict(step.as_dict(), perform="testman.util.utcnow")).history
+  assert history.counts == { "failed" : 1, "success" : 3, "skipped" : 1 }
+  assert history.maximum == 4 and history.performed == 3
+
+def test_assertion_with_bound_placeholders():
+  a1 = Assertion("result.id == {ID} and result.name == 'name-{ID}'")
+  a2 = Assertion("result.id == {ID} and result.name == 'name-{ID}'")
+  assert a1._bound is a2._bound
+  a1({ "id" : 1, "name" : "name-1" }, { "ID" : 1 })
+  try:
+    a1({ "id" : 2, "name" : "name-1" }, { "ID" : 1 })
+    assert False, "expected an AssertionError"
+  except AssertionError:
+    pass
+
+def test_assertion_with_environment_placeholders(monkeypatch):
+  # placeholders are taken as code, as if their value was substituted
+  monkeypatch.setenv("LIMIT", "3")
+  monkeypatch.setenv("NAME", "world")
+  Assertion("result > {LIMIT}")(4)
+  Assertion("result == '{NAME}' and {LIMIT} == 3")("world")
+  # as substituted, the value is a name, which isn't defined
+  for assertion in [ "result == {NAME}", "result == {NAME} and '}' == {QUOTE}}'" ]:
+    try:
+      Assertion(assertion)("world", { "QUOTE" : "'" })
+      assert False, "expected a NameError"
+    except NameError:
+      pass
+  try:
+    Assertion("result > {LIMIT}")(2)
+    assert False, "expected an AssertionError"
+  except AssertionError:
+    pass
+
+def test_bound_and_substituted_placeholders_agree(monkeypatch):
+  monkeypatch.setenv("COUNT", "0")
+  bound = Assertion("result == {COUNT}")
+  substituted = Assertion("result == {COUNT} and '}' == {QUOTE}}'")
+  assert bound._bound and substituted._bound is None
+  bound(0)
+  substituted(0, { "QUOTE" : "'" })
+  for assertion, vars in [ (bound, { "COUNT" : 0 }), (substituted, { "COUNT" : 0, "QUOTE" : "'" }) ]:
+    monkeypatch.delenv("COUNT")
+    try:
+      assertion(0, vars)
+      assert False, "expected a ValueError"
+    except ValueError:
+      pass
+    monkeypatch.setenv("COUNT", "0")
+
+def test_assertion_falls_back_to_substitution():
+  a = Assertion('result == {QUOTE}abc"')
+  assert a._bound is None
+  a("abc", { "QUOTE" : '"' })
+
+def big_output(size=1000):
+  return { "body" : "x" * size }
+
+def test_large_outputs_are_truncated():
+  from testman import Capture
+  step = Step(name="big", func=big_output)
+  step.execute()
+  Capture(limit=100).apply(step.last)
+  reference = step.last.output["$captured"]
+  assert reference["size"] == len('{"body": ""}') + 1000
+  assert len(reference["head"]) == 100
+  assert len(reference["sha256"]) == 64
+  assert step.last.value == { "body" : "x" * 1000 } # raw is still available
+
+def test_large_outputs_are_spilled(tmp_path):
+  from testman import Capture
+  capture = Capture(limit=100, spill=str(tmp_path))
+  steps   = [ Step(name=f"big {index}", func=big_output) for index in range(2) ]
+  for step in steps:
+    step.execute()
+    capture.apply(step.last)
+    step.last.release()
+  assert steps[0].last.output == steps[1].last.output
+  assert len(list(tmp_path.iterdir())) == 1
+  assert steps[0].last.value == { "body" : "x" * 1000 }
+
+def test_raw_outputs_are_released_after_use():
+  import testman
+  test = testman.Test.from_dict({
+    "steps" : [
+      { "name" : "a", "perform" : "testman.testers.mock.test",
+        "with" : { "value" : 1 } },
+      { "name" : "b", "perform" : "testman.testers.mock.test",
+        "with" : { "value" : "STEP[0].value" }, "always" : True },
+    ]
+  })
+  test.execute()
+  assert [ step.last.raw for step in test.steps ] == [ None, None ]
+  assert test.steps[1].last.output == { "value" : 1 }
+  test.execute()
+  assert test.steps[0].last.skipped
+  assert test.steps[1].last.output == { "value" : 1 }
+
+def test_phases_are_timed():
+  step = Step.from_dict({
+    "name"    : "timed",
+    "perform" : "testman.testers.mock.test",
+    "with"    : { "value" : 1 },
+    "assert"  : [ "result.value == 1", "result.value > 0" ],
+    "always"  : True
+  })
+  step.execute()
+  assert set(step.last.timings) == { "expand", "call", "process", "assert[0]", "assert[1]" }
+  step.execute()
+  stats = step.stats.as_dict()
+  assert stats["call"]["count"] == 2
+  assert stats["call"]["min"] <= stats["call"]["avg"] <= stats["call"]["max"]
+  assert "timings" not in step.result
+
+def test_assertion_timings_are_combined_per_suite():
+  import testman
+  suite = testman.Suite("suite", [ testman.Test("test", [
+    Step.from_dict({ "name" : name, "perform" : "testman.testers.mock.test",
+                     "assert" : "result == {}" })
+    for name in [ "a", "b" ]
+  ]) ])
+  suite.execute()
+  assert suite.stats.as_dict()["assert"]["count"] == 2
+
+def test_steps_can_be_profiled(tmp_path):
+  import testman
+  testman.profile(str(tmp_path))
+  try:
+    step = Step.from_dict({ "name" : "profiled step", "perform" : "testman.testers.mock.test" })
+    step.execute()
+  finally:
+    testman.profile(None)
+  assert step.status == "success"
+  assert [ f.name.startswith("profiled_step-") for f in tmp_path.iterdir() ] == [ True ]
@@ -0,0 +1,121 @@
+"""
+  Suite tests
+"""
+
+import threading
+import time
+
+import testman
+from testman import Suite, Step
+
+def slow_step(name):
+  return Step.from_dict({
+    "name"   : name,
+    "perform": "tests.test_suite.sleep_and_report",
+    "assert" : "result.thread"
+  })
+
+def sleep_and_report():
+  time.sleep(0.1)
+  return { "thread" : threading.current_thread().name }
+
+def suite_of(size):
+  return Suite("suite", [
+    testman.Test(f"test {index}", [ slow_step(f"step {index}") ], uid=f"t{index}")
+    for index in range(size)
+  ])
+
+def test_sequential_execution():
+  suite = suite_of(2).execute()
+  assert suite.status == "success"
+
+def test_parallel_execution_with_threads():
+  suite = suite_of(4)
+  start = time.time()
+  suite.execute(workers=4)
+  assert time.time() - start < 0.3
+  assert suite.status == "success"
+  threads = { test.steps[0].last.value["thread"] for test in suite.tests }
+  assert len(threads) > 1
+
+def test_parallel_execution_with_processes():
+  suite = suite_of(3)
+  notifications = []
+  suite.on_change(lambda change, context: notifications.append(change))
+  suite.execute(workers=3, processes=True)
+  assert suite.status == "success"
+  assert all(len(test.steps[0].runs) == 1 for test in suite.tests)
+  assert notifications == [ "run" ] * 3 + [ "execute" ]
+
+def test_relative_files_are_resolved_in_work_dir(tmp_path):
+  (tmp_path / "body.txt").write_text("hello {NAME}")
+  test = testman.Test("files", [
+    Step.from_dict({
+      "name"   : "step",
+      "perform": "testman.testers.mock.test",
+      "with"   : { "body" : "~body.txt" },
+    })
+  ], constants={ "NAME" : testman.Constant("'world'") }, work_dir=str(tmp_path))
+  test.execute()
+  assert test.steps[0].last.value == { "body" : "hello world" }
+
+async def async_sleep_and_count():
+  import asyncio
+  global in_flight, max_in_flight
+  in_flight += 1
+  max_in_flight = max(in_flight, max_in_flight)
+  await asyncio.sleep(0.05)
+  in_flight -= 1
+  return True
+
+in_flight     = 0
+max_in_flight = 0
+
+def test_async_execution_with_bounded_concurrency():
+  import asyncio
+  suite = Suite("suite", [
+    testman.Test(f"test {index}", [
+      Step.from_dict({
+        "name"   : f"step {index}",
+        "perform": "tests.test_suite.async_sleep_and_count",
+        "assert" : "result == True"
+      })
+    ]) for index in range(10)
+  ])
+  start = time.time()
+  asyncio.run(suite.execute_async(concurrency=5))
+  assert time.time() - start < 0.4
+  assert max_in_flight == 5
+  assert suite.status == "success"
+
+def recomputed(suite):
+  return testman.reduce_states([
+    step.status for test in suite.tests for step in test.steps
+  ])
+
+def test_status_is_maintained_incrementally():
+  suite = testman.Suite("suite", [
+    testman.Test.from_dict({ "name" : f"test {index}", "steps" : [
+      { "name" : "ok", "perform" : "testman.testers.mock.test" },
+      { "name" : "fails", "perform" : "testman.testers.mock.test",
+        "with" : { "fail" : "oops" }, "continue" : True }
+    ][:index+1] }) for index in range(2)
+  ])
+  assert suite.status == "unknown" == recomputed(suite)
+  suite.execute()
+  assert suite.status == "pending" == recomputed(suite)
+  assert suite.summary[suite.tests[1].uid]["pending"] == 1
+  suite.tests[1].steps[1].noretry = True
+  assert suite.tests[1].status == "failed"
+  assert suite.status == "failed" == recomputed(suite)
+  suite.tests[1].steps[1].ignore = True
+  assert suite.status == "ignored" == recomputed(suite)
+  suite.reset()
+  assert suite.status == "unknown" == recomputed(suite)
+  assert suite.tests[0].overview == [ "unknown" ]
+  suite.add(testman.Test("failed", [
+    testman.Step(name="failed", func=lambda: False, noretry=True,
+                 runs=[ testman.Run.from_dict({ "start" : None, "end" : None,
+                                                "status" : "failed" }) ])
+  ]))
+  assert suite.status == "failed" == recomputed(suite)
@@ -0,0 +1,88 @@
+"""
+  Work queue tests
+
+  A coordinator puts the tests of a suite on a work queue, workers claim and
+  execute them, and their runs are merged back into the suite.
+"""
+
+import multiprocessing
+
+import pytest
+
+from testman.state import JsonState
+from testman.workqueue import WorkQueue, dispatch, work
+
+from tests.test_state import a_suite
+from tests.test_scheduler import Clock
+
+def test_tests_are_executed_by_workers(tmp_path):
+  queue = WorkQueue(str(tmp_path / "work.db"))
+  suite = a_suite("distributed", tests=3)
+  def worker(seconds):
+    # executing all items while the coordinator waits
+    assert work(queue, worker="worker", idle=0) == 3
+  dispatch(suite, queue, sleep=worker)
+  assert suite.status == "success"
+  assert [ len(test.steps[0].runs) for test in suite.tests ] == [ 1, 1, 1 ]
+  assert suite.tests[2].steps[0].last.value == { "hello" : "world" }
+  assert len(queue) == 0
+
+def test_expired_leases_are_claimed_again(tmp_path):
+  clock = Clock()
+  queue = WorkQueue(str(tmp_path / "work.db"), attempts=2, clock=clock.time)
+  queue.put("suite", a_suite().tests[0].as_dict())
+  dead  = queue.claim("dead", lease=10)
+  assert queue.claim("alive", lease=10) is None
+  clock.sleep(11)
+  item = queue.claim("alive", lease=10)
+  assert item.id == dead.id and item.attempts == 2
+  # the dead worker can no longer complete the item
+  assert not queue.complete(dead, "dead", {})
+  assert queue.complete(item, "alive", { "name" : "done" })
+  assert queue.take([ item.id ]) == [ (item.id, "done", { "name" : "done" }, None) ]
+
+def test_items_fail_after_too_many_attempts(tmp_path):
+  clock = Clock()
+  queue = WorkQueue(str(tmp_path / "work.db"), attempts=2, clock=clock.time)
+  id = queue.put("suite", {})
+  queue.claim("first", lease=10)
+  clock.sleep(11)
+  item = queue.claim("second", lease=10)
+  queue.fail(item, "second", "boom")
+  assert queue.claim("third") is None
+  assert queue.take([ id ]) == [ (id, "failed", None, "boom") ]
+
+def test_dispatch_times_out(tmp_path):
+  queue = WorkQueue(str(tmp_path / "work.db"))
+  clock = Clock()
+  with pytest.raises(TimeoutError):
+    dispatch(a_suite(tests=3), queue, timeout=5, clock=clock.time, sleep=clock.sleep)
+  assert len(queue) == 0
+
+def test_dispatch_cancels_pending_tests_when_interrupted(tmp_path):
+  queue = WorkQueue(str(tmp_path / "work.db"))
+  def interrupt(seconds):
+    raise KeyboardInterrupt()
+  with pytest.raises(KeyboardInterrupt):
+    dispatch(a_suite(tests=3), queue, sleep=interrupt)
+  assert len(queue) == 0
+  assert queue.claim("worker") is None
+
+def run_worker(filename):
+  work(WorkQueue(filename), poll=0.05, idle=2)
+
+def test_results_are_written_back_into_the_state(tmp_path):
+  filename = str(tmp_path / "work.db")
+  state    = JsonState(str(tmp_path / "state.json"))
+  state.add(a_suite("distributed", tests=8))
+  workers = [
+    multiprocessing.Process(target=run_worker, args=(filename,)) for _ in range(2)
+  ]
+  for worker in workers:
+    worker.start()
+  dispatch(state["distributed"], WorkQueue(filename), poll=0.05, timeout=30)
+  for worker in workers:
+    worker.join()
+  stored = JsonState(str(tmp_path / "state.json"))["distributed"]
+  assert stored.status == "success"
+  assert all(len(test.steps[0].runs) == 1 for test in stored.tests)